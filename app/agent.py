@@ -1,10 +1,70 @@
-from .workflow import create_workflow, create_simple_workflow
-from .retriever import get_retriever
+from .retriever import BatchingRetriever, get_retriever, get_vector_store_version
 import asyncio
-from typing import AsyncGenerator
+import hashlib
+import re
+from collections import OrderedDict
+from functools import lru_cache
+from typing import AsyncGenerator, Tuple
 
-# 使用简化版工作流提高性能
-graph = create_simple_workflow()
+import numpy as np
+
+# 使用简化版工作流提高性能，首次调用时再构建，避免导入时加载工作流依赖
+_graph = None
+
+def _get_graph():
+    global _graph
+    if _graph is None:
+        from .workflow import create_simple_workflow
+        _graph = create_simple_workflow()
+    return _graph
+
+# 段落清理所用的正则，模块加载时编译一次
+_URL_RE = re.compile(r'http\S+')
+_EMAIL_RE = re.compile(r'\S+@\S+')
+_NUM_RE = re.compile(r'\b\d+\b')
+_SPAM_KEYWORDS = ('添加微信', '领取', '创业项目', '200个', '互联网创业', '货比三家', '搜一下就不会上当')
+# 质量判断使用的垃圾关键词，不含仅在清理时移除的最后一项
+_QUALITY_SPAM_RE = re.compile('|'.join(map(re.escape, _SPAM_KEYWORDS[:-1])))
+
+# 特殊符号字符类，一次扫描即可统计全部特殊符号
+_SPECIAL_CHARS = '@#$%&*+=<>'
+_SPECIAL_RE = re.compile(f'[{re.escape(_SPECIAL_CHARS)}]')
+
+# 超过该长度的段落改用NumPy向量化统计数字和特殊符号
+_VECTORIZE_MIN_LENGTH = 512
+_SPECIAL_CODEPOINTS = np.array([ord(char) for char in _SPECIAL_CHARS], dtype=np.intp)
+
+# 各查询类型的主题关键词，编译为单个交替正则，一次扫描即可判断段落是否命中
+_TOPIC_KEYWORDS = {
+    'startup': ['创业', '公司', '产品', '市场', '团队', '融资', '投资人'],
+    'tech': ['技术', '算法', '产品', '开发', '创新', '代码', '编程'],
+    'management': ['管理', '团队', '组织', '文化', '领导', '激励', '考核'],
+}
+_TOPIC_RES = {
+    topic: re.compile('|'.join(map(re.escape, words)))
+    for topic, words in _TOPIC_KEYWORDS.items()
+}
+
+# 查询触发词 -> 主题，按优先级排列
+_QUERY_TOPICS = (('创业', 'startup'), ('技术', 'tech'), ('管理', 'management'))
+
+# 主题 -> 段落匹配函数；未识别主题时提取包含张一鸣的段落
+_TOPIC_MATCHERS = {topic: pattern.search for topic, pattern in _TOPIC_RES.items()}
+_TOPIC_MATCHERS[None] = lambda paragraph: '张一鸣' in paragraph
+
+# 查询触发词 -> 响应模板，按优先级排列
+_RESPONSE_TEMPLATES = (
+    ('张一鸣', "根据张一鸣的微博内容，以下是相关信息：\n\n{}\n\n这些内容来自张一鸣的微博记录，反映了他的创业思考和管理理念。"),
+    ('字节跳动', "关于字节跳动的相关信息：\n\n{}\n\n这些内容体现了字节跳动的企业文化和发展历程。"),
+)
+_DEFAULT_RESPONSE_TEMPLATE = "根据文档内容，相关信息如下：\n\n{}\n\n如需更详细信息，请参考上传的文档。"
+
+def _dispatch(query, table, default):
+    """返回查询命中的第一个触发词对应的值"""
+    for trigger, value in table:
+        if trigger in query:
+            return value
+    return default
 
 # 智能的本地响应生成器
 def generate_local_response(query, docs_text):
@@ -12,93 +72,83 @@ def generate_local_response(query, docs_text):
     if not docs_text:
         return "抱歉，知识库中暂无相关内容。请尝试上传相关文档或询问其他问题。"
     
-    # 智能响应生成逻辑
-    if "张一鸣" in query:
-        # 提取关键信息并总结
-        key_points = extract_key_points(docs_text, query)
-        return f"根据张一鸣的微博内容，以下是相关信息：\n\n{key_points}\n\n这些内容来自张一鸣的微博记录，反映了他的创业思考和管理理念。"
-    elif "字节跳动" in query:
-        key_points = extract_key_points(docs_text, query)
-        return f"关于字节跳动的相关信息：\n\n{key_points}\n\n这些内容体现了字节跳动的企业文化和发展历程。"
-    else:
-        key_points = extract_key_points(docs_text, query)
-        return f"根据文档内容，相关信息如下：\n\n{key_points}\n\n如需更详细信息，请参考上传的文档。"
+    # 智能响应生成逻辑：按查询触发词选择响应模板
+    template = _dispatch(query, _RESPONSE_TEMPLATES, _DEFAULT_RESPONSE_TEMPLATE)
+    return template.format(extract_key_points(docs_text, query))
 
 def extract_key_points(docs_text, query):
     """从文档内容中提取关键信息点"""
-    # 按段落分割文档内容
-    paragraphs = [p.strip() for p in docs_text.split('\n') if p.strip()]
+    # 清理并过滤后的段落按文档内容缓存，追问同一批文档时无需重复清洗
+    quality_paragraphs = _clean_doc_paragraphs(docs_text)
     
-    # 根据查询类型提取相关信息
+    # 根据查询类型选定段落匹配函数，循环内不再重复判断查询类型
+    matches_topic = _TOPIC_MATCHERS[_dispatch(query, _QUERY_TOPICS, None)]
     key_points = []
     
     # 先尝试提取与查询高度相关的内容
-    for para in paragraphs:
-        # 清理段落内容，移除垃圾信息
-        cleaned_para = clean_paragraph(para)
-        
-        # 过滤掉过短的段落（可能是不完整的句子）
-        if len(cleaned_para) < 20:
-            continue
-            
-        # 根据查询类型提取相关信息
-        if "创业" in query or "创业经历" in query:
-            if any(word in cleaned_para for word in ['创业', '公司', '产品', '市场', '团队', '融资', '投资人']):
-                # 进一步过滤，确保内容质量
-                if is_quality_content(cleaned_para):
-                    key_points.append(f"• {cleaned_para}")
-        elif "技术" in query or "技术看法" in query:
-            if any(word in cleaned_para for word in ['技术', '算法', '产品', '开发', '创新', '代码', '编程']):
-                if is_quality_content(cleaned_para):
-                    key_points.append(f"• {cleaned_para}")
-        elif "管理" in query or "管理理念" in query:
-            if any(word in cleaned_para for word in ['管理', '团队', '组织', '文化', '领导', '激励', '考核']):
-                if is_quality_content(cleaned_para):
-                    key_points.append(f"• {cleaned_para}")
-        else:
-            # 通用情况，提取包含张一鸣的段落
-            if "张一鸣" in cleaned_para and is_quality_content(cleaned_para):
-                key_points.append(f"• {cleaned_para}")
+    for _, cleaned_para in quality_paragraphs:
+        if matches_topic(cleaned_para):
+            key_points.append(f"• {cleaned_para}")
+            # 最多返回8个关键点，凑满即停止扫描
+            if len(key_points) >= 8:
+                break
     
     # 如果提取到关键点，返回它们
     if key_points:
-        return "\n".join(key_points[:8])  # 最多返回8个关键点
+        return "\n".join(key_points)
     
-    # 如果没有提取到关键点，返回经过过滤的原始内容（放宽条件）
+    # 如果没有提取到关键点，返回前15个段落中经过过滤的内容（最多5条）
     fallback_points = []
-    for para in paragraphs[:15]:
-        # 清理段落内容
-        cleaned_para = clean_paragraph(para)
-        
-        # 放宽长度限制，但确保内容质量
-        if len(cleaned_para) >= 15 and is_quality_content(cleaned_para):
-            fallback_points.append(f"• {cleaned_para}")
-    
-    return "\n".join(fallback_points[:5]) if fallback_points else "暂无相关信息。"
-
-def is_quality_content(paragraph):
-    """判断段落内容是否高质量"""
-    # 排除垃圾信息
-    spam_keywords = ['添加微信', '领取', '创业项目', '200个', '互联网创业', '货比三家']
-    if any(spam in paragraph for spam in spam_keywords):
-        return False
-    
-    # 排除过短的段落
-    if len(paragraph) < 30:
-        return False
-    
-    # 排除包含过多数字和符号的段落（可能是乱码）
-    digit_ratio = sum(c.isdigit() for c in paragraph) / len(paragraph)
-    if digit_ratio > 0.3:
-        return False
-    
-    # 排除包含特殊符号过多的段落
-    special_chars = ['@', '#', '$', '%', '&', '*', '+', '=', '<', '>']
-    special_count = sum(paragraph.count(char) for char in special_chars)
-    if special_count > 5:
-        return False
-    
-    return True
+    for position, cleaned_para in quality_paragraphs:
+        if position >= 15 or len(fallback_points) >= 5:
+            break
+        fallback_points.append(f"• {cleaned_para}")
+    
+    return "\n".join(fallback_points) if fallback_points else "暂无相关信息。"
+
+@lru_cache(maxsize=64)
+def _clean_doc_paragraphs(docs_text):
+    """按段落分割并清理文档，只保留高质量段落，返回 ((段落序号, 清理后内容), ...)"""
+    paragraphs = [p.strip() for p in docs_text.split('\n') if p.strip()]
+    
+    quality_paragraphs = []
+    for position, para in enumerate(paragraphs):
+        # 高质量段落至少30字，已覆盖原先的20字/15字长度门槛
+        cleaned_para, is_quality = _clean_and_score(para)
+        if is_quality:
+            quality_paragraphs.append((position, cleaned_para))
+    
+    return tuple(quality_paragraphs)
+
+def _clean_and_score(paragraph):
+    """清理段落并在一次扫描中完成质量判断，返回 (cleaned, is_quality)"""
+    cleaned = clean_paragraph(paragraph)
+    length = len(cleaned)
+    
+    # 过短或仍含垃圾信息的段落直接判定为低质量，无需逐字符扫描
+    if length < 30 or _QUALITY_SPAM_RE.search(cleaned):
+        return cleaned, False
+    
+    digit_count, special_count = _char_stats(cleaned)
+    return cleaned, digit_count / length <= 0.3 and special_count <= 5
+
+def _char_stats(text):
+    """统计数字和特殊符号个数，均由C层字符串操作完成"""
+    if len(text) > _VECTORIZE_MIN_LENGTH:
+        # 长段落转为码点数组，一次ASCII直方图同时得到ASCII数字和特殊符号个数；
+        # 非ASCII字符按去重后的码点逐个用 str.isdigit 判断，与短段落的数字定义保持一致
+        codepoints = np.frombuffer(text.encode('utf-32-le', 'surrogatepass'), dtype=np.uint32)
+        is_ascii = codepoints < 128
+        ascii_hist = np.bincount(codepoints[is_ascii], minlength=128)
+        digit_count = int(ascii_hist[0x30:0x3A].sum())
+        special_count = int(ascii_hist[_SPECIAL_CODEPOINTS].sum())
+        non_ascii, counts = np.unique(codepoints[~is_ascii], return_counts=True)
+        digit_count += sum(int(count) for codepoint, count in zip(non_ascii.tolist(), counts) if chr(codepoint).isdigit())
+        return digit_count, special_count
+    
+    digit_count = sum(map(str.isdigit, text))
+    special_count = len(_SPECIAL_RE.findall(text))
+    return digit_count, special_count
 
 def clean_paragraph(paragraph):
     """清理段落内容"""
@@ -106,19 +156,17 @@ def clean_paragraph(paragraph):
     cleaned = ' '.join(paragraph.split())
     
     # 移除URL链接
-    import re
-    cleaned = re.sub(r'http\S+', '', cleaned)
+    cleaned = _URL_RE.sub('', cleaned)
     
     # 移除邮箱地址
-    cleaned = re.sub(r'\S+@\S+', '', cleaned)
+    cleaned = _EMAIL_RE.sub('', cleaned)
     
-    # 移除垃圾信息关键词
-    spam_keywords = ['添加微信', '领取', '创业项目', '200个', '互联网创业', '货比三家', '搜一下就不会上当']
-    for spam in spam_keywords:
+    # 移除垃圾信息关键词；按列表顺序逐个替换，关键词相互重叠时与单次交替匹配的结果不同
+    for spam in _SPAM_KEYWORDS:
         cleaned = cleaned.replace(spam, '')
     
     # 移除数字编号（如88、113等）
-    cleaned = re.sub(r'\b\d+\b', '', cleaned)
+    cleaned = _NUM_RE.sub('', cleaned)
     
     # 移除多余的空格
     cleaned = ' '.join(cleaned.split())
@@ -127,20 +175,71 @@ def clean_paragraph(paragraph):
 
 def run_agentic_pipeline(query: str):
     state = {"query": query}
-    result = graph.invoke(state)
+    result = _get_graph().invoke(state)
     return result["response"]
 
+# 检索结果缓存，按 (query, 向量库版本) 索引，向量库重建后自动失效
+_RETRIEVAL_CACHE_SIZE = 1024
+_retrieval_cache: "OrderedDict[Tuple[str, int], Tuple[str, ...]]" = OrderedDict()
+
+# 已生成的流式响应缓存，按 (query, docs_text) 摘要索引，保存原始分块以便原样回放
+_RESPONSE_CACHE_SIZE = 512
+_response_cache: "OrderedDict[str, Tuple[str, ...]]" = OrderedDict()
+
+# 并发请求的检索合并为微批次执行
+_batching_retriever = BatchingRetriever(get_retriever)
+
+def _remember(cache, key, value, max_size):
+    cache[key] = value
+    cache.move_to_end(key)
+    while len(cache) > max_size:
+        cache.popitem(last=False)
+
+async def _retrieve_chunks(query: str) -> Tuple[str, ...]:
+    """检索文档片段，缓存未命中时交给微批次检索器"""
+    cache_key = (query, get_vector_store_version())
+    cached = _retrieval_cache.get(cache_key)
+    if cached is not None:
+        _retrieval_cache.move_to_end(cache_key)
+        return cached
+    
+    from .workflow import select_prompt_docs
+
+    docs = await _batching_retriever.submit(query)
+    # 使用更多文档内容（最多10个片段），去掉重复片段并限制总长度
+    chunks = tuple(d.page_content for d in select_prompt_docs(docs[:10])) if docs else ()
+    _remember(_retrieval_cache, cache_key, chunks, _RETRIEVAL_CACHE_SIZE)
+    return chunks
+
+def _response_cache_key(query: str, docs_text: str) -> str:
+    return hashlib.blake2b(f"{query}\0{docs_text}".encode("utf-8"), digest_size=16).hexdigest()
+
 async def run_agentic_pipeline_stream(query: str) -> AsyncGenerator[str, None]:
-    """优化的流式版本智能体管道，使用真正的流式AI调用"""
+    """优化的流式版本智能体管道，使用真正的流式AI调用
+
+    只产出原始文本片段，SSE 帧格式由 HTTP 层负责拼装。
+    """
     from .workflow import generate_ai_response_stream
     
-    retriever = get_retriever()
-    docs = retriever.invoke(query)
-    # 使用更多文档内容（最多10个片段）
-    docs_text = "\n".join([d.page_content for d in docs[:10]]) if docs else ""
+    # 检索在工作线程中按批次执行，避免阻塞事件循环上的其他请求
+    docs_text = "\n".join(await _retrieve_chunks(query))
     
-    # 使用流式AI模型生成响应
-    async for chunk in generate_ai_response_stream(query, docs_text):
-        yield f"data: {chunk}\n\n"
+    # 相同问题和文档内容直接回放已生成的响应
+    cache_key = _response_cache_key(query, docs_text)
+    cached_chunks = _response_cache.get(cache_key)
+    if cached_chunks is not None:
+        _response_cache.move_to_end(cache_key)
+        for chunk in cached_chunks:
+            yield chunk
+        return
     
-    yield "data: [DONE]\n\n"
+    # 使用流式AI模型生成响应
+    chunks = []
+    outcome = {}
+    async for chunk in generate_ai_response_stream(query, docs_text, outcome):
+        chunks.append(chunk)
+        yield chunk
+    
+    # 只缓存模型完整生成的回答；失败后的兜底内容（可能夹带部分模型输出）不回放给后续请求
+    if outcome.get("from_llm"):
+        _remember(_response_cache, cache_key, tuple(chunks), _RESPONSE_CACHE_SIZE)
@@ -2,34 +2,45 @@
 
 from __future__ import annotations
 
+import asyncio
+import heapq
 import time
+from functools import lru_cache
 from threading import Lock
-from typing import Any, Dict, Tuple, Literal
+from typing import Any, Dict, List, Tuple, Literal
 from urllib.parse import urlencode
 from uuid import uuid4
 
 import httpx
+import orjson
 import structlog
 from fastapi import APIRouter, Depends, HTTPException, Query, status
 from pydantic import BaseModel, Field, HttpUrl, ConfigDict
 
-try:  # pragma: no cover - optional dependency safety
-    from google.oauth2 import id_token
-    from google.auth.transport import requests as google_requests
-except ModuleNotFoundError as exc:  # pragma: no cover - defensive guard
-    raise RuntimeError(
-        "google-auth package must be installed to use Google login endpoints"
-    ) from exc
-
 from .config import Settings, get_settings
 
 
+@lru_cache(maxsize=1)
+def _load_google() -> Tuple[Any, Any]:
+    """Import google-auth on first use so WeChat-only deployments never pay for it."""
+
+    try:  # pragma: no cover - optional dependency safety
+        from google.oauth2 import id_token
+        from google.auth.transport import requests as google_requests
+    except ModuleNotFoundError as exc:  # pragma: no cover - defensive guard
+        raise RuntimeError(
+            "google-auth package must be installed to use Google login endpoints"
+        ) from exc
+    return id_token, google_requests
+
+
 class AuthStateManager:
     """Track OAuth state parameters with expiration to prevent CSRF attacks."""
 
     def __init__(self, default_ttl_seconds: int = 600) -> None:
         self._default_ttl_seconds = default_ttl_seconds
         self._states: Dict[str, Tuple[str, float, int]] = {}
+        self._expiry_heap: List[Tuple[float, str]] = []
         self._lock = Lock()
 
     @property
@@ -43,6 +54,7 @@ class AuthStateManager:
         with self._lock:
             self._cleanup(now)
             self._states[token] = (provider, now, ttl)
+            heapq.heappush(self._expiry_heap, (now + ttl, token))
         return token
 
     def validate_state(self, provider: str, token: str | None) -> None:
@@ -71,12 +83,11 @@ class AuthStateManager:
             )
 
     def _cleanup(self, now: float) -> None:
-        expired = [
-            token
-            for token, (_, created_at, ttl) in self._states.items()
-            if now - created_at > ttl
-        ]
-        for token in expired:
+        # Only pop entries whose expiry has passed; validated tokens are already
+        # gone from ``_states`` and are simply discarded when they surface.
+        heap = self._expiry_heap
+        while heap and heap[0][0] < now:
+            _, token = heapq.heappop(heap)
             self._states.pop(token, None)
 
 
@@ -97,10 +108,37 @@ def get_state_manager(settings: Settings = Depends(get_settings)) -> AuthStateMa
     return _state_manager
 
 
+_http_client: httpx.AsyncClient | None = None
+
+
+async def get_http_client(settings: Settings = Depends(get_settings)) -> httpx.AsyncClient:
+    """Return the shared HTTP/2 client used for OAuth provider calls.
+
+    Runs on the event loop rather than the threadpool, so the lazy check-and-set
+    cannot race and concurrent first callers share one client.
+    """
+
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            timeout=settings.oauth_http_timeout_seconds,
+            http2=True,
+            limits=httpx.Limits(max_keepalive_connections=50, max_connections=100),
+        )
+    return _http_client
+
+
+async def close_http_client() -> None:
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+
 def _parse_json_response(response: httpx.Response, provider: str) -> Dict[str, Any]:
     try:
-        return response.json()
-    except ValueError as exc:  # pragma: no cover - defensive guard
+        return orjson.loads(response.content)
+    except orjson.JSONDecodeError as exc:  # pragma: no cover - defensive guard
         display_provider = provider.replace("_", " ").title()
         logger.warning(
             "%s_invalid_json",
@@ -114,6 +152,34 @@ def _parse_json_response(response: httpx.Response, provider: str) -> Dict[str, A
         ) from exc
 
 
+@lru_cache(maxsize=8)
+def _google_authorization_base(client_id: str, redirect_uri: str) -> str:
+    """Encode the state-independent part of the Google authorization URL once."""
+
+    params = {
+        "client_id": client_id,
+        "response_type": "code",
+        "scope": "openid email profile",
+        "redirect_uri": redirect_uri,
+        "access_type": "offline",
+        "prompt": "consent",
+    }
+    return "https://accounts.google.com/o/oauth2/v2/auth?" + urlencode(params)
+
+
+@lru_cache(maxsize=8)
+def _wechat_login_base(app_id: str, redirect_uri: str) -> str:
+    """Encode the state-independent part of the WeChat QR login URL once."""
+
+    params = {
+        "appid": app_id,
+        "redirect_uri": redirect_uri,
+        "response_type": "code",
+        "scope": "snsapi_login",
+    }
+    return "https://open.weixin.qq.com/connect/qrconnect?" + urlencode(params)
+
+
 def _ensure_google_config(settings: Settings) -> None:
     if not settings.google_client_id or not settings.google_client_secret or not settings.google_redirect_uri:
         raise HTTPException(
@@ -122,6 +188,19 @@ def _ensure_google_config(settings: Settings) -> None:
         )
 
 
+def _require_google() -> Tuple[Any, Any]:
+    """Resolve google-auth before any provider call so a missing package never burns an authorization code."""
+
+    try:
+        return _load_google()
+    except RuntimeError as exc:
+        logger.error("google_auth_unavailable", error=str(exc))
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Google login is not available",
+        ) from exc
+
+
 def _ensure_wechat_config(settings: Settings) -> None:
     if not settings.wechat_app_id or not settings.wechat_app_secret or not settings.wechat_redirect_uri:
         raise HTTPException(
@@ -212,17 +291,13 @@ async def initiate_google_login(
     """Generate the Google OAuth authorization URL and state token."""
 
     _ensure_google_config(settings)
+    _require_google()
     state = state_manager.create_state("google", settings.oauth_state_ttl_seconds)
-    params = {
-        "client_id": settings.google_client_id,
-        "response_type": "code",
-        "scope": "openid email profile",
-        "redirect_uri": settings.google_redirect_uri,
-        "state": state,
-        "access_type": "offline",
-        "prompt": "consent",
-    }
-    authorization_url = "https://accounts.google.com/o/oauth2/v2/auth?" + urlencode(params)
+    # State tokens are hex, so they can be appended without percent-encoding.
+    authorization_url = (
+        _google_authorization_base(settings.google_client_id, settings.google_redirect_uri)
+        + f"&state={state}"
+    )
     return GoogleInitResponse(
         state=state,
         expires_in=settings.oauth_state_ttl_seconds,
@@ -236,47 +311,48 @@ async def handle_google_callback(
     state: str | None = Query(default=None, description="State parameter for CSRF protection"),
     settings: Settings = Depends(get_settings),
     state_manager: AuthStateManager = Depends(get_state_manager),
+    client: httpx.AsyncClient = Depends(get_http_client),
 ) -> GoogleCallbackResponse:
     """Exchange authorization code for tokens and return verified Google profile data."""
 
     _ensure_google_config(settings)
+    id_token, google_requests = _require_google()
     state_manager.validate_state("google", state)
 
-    async with httpx.AsyncClient(timeout=settings.oauth_http_timeout_seconds) as client:
-        try:
-            token_response = await client.post(
-                "https://oauth2.googleapis.com/token",
-                data={
-                    "client_id": settings.google_client_id,
-                    "client_secret": settings.google_client_secret,
-                    "code": code,
-                    "grant_type": "authorization_code",
-                    "redirect_uri": settings.google_redirect_uri,
-                },
-            )
-            token_response.raise_for_status()
-        except httpx.TimeoutException as exc:
-            logger.warning("google_token_timeout", error=str(exc))
-            raise HTTPException(
-                status_code=status.HTTP_504_GATEWAY_TIMEOUT,
-                detail="Google token endpoint timeout",
-            ) from exc
-        except httpx.HTTPStatusError as exc:
-            logger.warning(
-                "google_token_http_error",
-                status_code=exc.response.status_code,
-                response=exc.response.text,
-            )
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"Google token exchange failed: {exc.response.text}",
-            ) from exc
-        except httpx.HTTPError as exc:
-            logger.warning("google_token_request_failed", error=str(exc))
-            raise HTTPException(
-                status_code=status.HTTP_502_BAD_GATEWAY,
-                detail="Failed to contact Google token endpoint",
-            ) from exc
+    try:
+        token_response = await client.post(
+            "https://oauth2.googleapis.com/token",
+            data={
+                "client_id": settings.google_client_id,
+                "client_secret": settings.google_client_secret,
+                "code": code,
+                "grant_type": "authorization_code",
+                "redirect_uri": settings.google_redirect_uri,
+            },
+        )
+        token_response.raise_for_status()
+    except httpx.TimeoutException as exc:
+        logger.warning("google_token_timeout", error=str(exc))
+        raise HTTPException(
+            status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+            detail="Google token endpoint timeout",
+        ) from exc
+    except httpx.HTTPStatusError as exc:
+        logger.warning(
+            "google_token_http_error",
+            status_code=exc.response.status_code,
+            response=exc.response.text,
+        )
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Google token exchange failed: {exc.response.text}",
+        ) from exc
+    except httpx.HTTPError as exc:
+        logger.warning("google_token_request_failed", error=str(exc))
+        raise HTTPException(
+            status_code=status.HTTP_502_BAD_GATEWAY,
+            detail="Failed to contact Google token endpoint",
+        ) from exc
 
     token_data = _parse_json_response(token_response, "google")
     id_token_value = token_data.get("id_token")
@@ -287,8 +363,12 @@ async def handle_google_callback(
         )
 
     try:
+        # Verification fetches Google's certs and checks the RSA signature synchronously,
+        # so keep it off the event loop.
         google_request = google_requests.Request()
-        verified_token = id_token.verify_oauth2_token(id_token_value, google_request, settings.google_client_id)
+        verified_token = await asyncio.to_thread(
+            id_token.verify_oauth2_token, id_token_value, google_request, settings.google_client_id
+        )
     except ValueError as exc:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Invalid Google ID token: {exc}") from exc
 
@@ -321,16 +401,9 @@ async def initiate_wechat_login(
 
     _ensure_wechat_config(settings)
     state = state_manager.create_state("wechat", settings.oauth_state_ttl_seconds)
-    params = {
-        "appid": settings.wechat_app_id,
-        "redirect_uri": settings.wechat_redirect_uri,
-        "response_type": "code",
-        "scope": "snsapi_login",
-        "state": state,
-    }
     login_url = (
-        "https://open.weixin.qq.com/connect/qrconnect?"
-        + urlencode(params)
+        _wechat_login_base(settings.wechat_app_id, settings.wechat_redirect_uri)
+        + f"&state={state}"
         + "#wechat_redirect"
     )
     return WeChatInitResponse(
@@ -346,6 +419,7 @@ async def handle_wechat_callback(
     state: str | None = Query(default=None, description="State parameter for CSRF protection"),
     settings: Settings = Depends(get_settings),
     state_manager: AuthStateManager = Depends(get_state_manager),
+    client: httpx.AsyncClient = Depends(get_http_client),
 ) -> WeChatCallbackResponse:
     """Exchange the WeChat authorization code for tokens and return basic user information."""
 
@@ -353,63 +427,62 @@ async def handle_wechat_callback(
     state_manager.validate_state("wechat", state)
 
     profile = WeChatProfile()
-    async with httpx.AsyncClient(timeout=settings.oauth_http_timeout_seconds) as client:
-        try:
-            token_response = await client.get(
-                "https://api.weixin.qq.com/sns/oauth2/access_token",
-                params={
-                    "appid": settings.wechat_app_id,
-                    "secret": settings.wechat_app_secret,
-                    "code": code,
-                    "grant_type": "authorization_code",
-                },
-            )
-            token_response.raise_for_status()
-        except httpx.TimeoutException as exc:
-            logger.warning("wechat_token_timeout", error=str(exc))
-            raise HTTPException(
-                status_code=status.HTTP_504_GATEWAY_TIMEOUT,
-                detail="WeChat token endpoint timeout",
-            ) from exc
-        except httpx.HTTPStatusError as exc:
-            logger.warning(
-                "wechat_token_http_error",
-                status_code=exc.response.status_code,
-                response=exc.response.text,
-            )
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"WeChat token exchange failed: {exc.response.text}",
-            ) from exc
-        except httpx.HTTPError as exc:
-            logger.warning("wechat_token_request_failed", error=str(exc))
-            raise HTTPException(
-                status_code=status.HTTP_502_BAD_GATEWAY,
-                detail="Failed to contact WeChat token endpoint",
-            ) from exc
+    try:
+        token_response = await client.get(
+            "https://api.weixin.qq.com/sns/oauth2/access_token",
+            params={
+                "appid": settings.wechat_app_id,
+                "secret": settings.wechat_app_secret,
+                "code": code,
+                "grant_type": "authorization_code",
+            },
+        )
+        token_response.raise_for_status()
+    except httpx.TimeoutException as exc:
+        logger.warning("wechat_token_timeout", error=str(exc))
+        raise HTTPException(
+            status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+            detail="WeChat token endpoint timeout",
+        ) from exc
+    except httpx.HTTPStatusError as exc:
+        logger.warning(
+            "wechat_token_http_error",
+            status_code=exc.response.status_code,
+            response=exc.response.text,
+        )
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"WeChat token exchange failed: {exc.response.text}",
+        ) from exc
+    except httpx.HTTPError as exc:
+        logger.warning("wechat_token_request_failed", error=str(exc))
+        raise HTTPException(
+            status_code=status.HTTP_502_BAD_GATEWAY,
+            detail="Failed to contact WeChat token endpoint",
+        ) from exc
 
-        token_data = _parse_json_response(token_response, "wechat")
-        if token_data.get("errcode"):
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"WeChat error: {token_data.get('errmsg', 'unknown error')}",
-            )
+    token_data = _parse_json_response(token_response, "wechat")
+    if token_data.get("errcode"):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"WeChat error: {token_data.get('errmsg', 'unknown error')}",
+        )
 
-        access_token = token_data.get("access_token")
-        openid = token_data.get("openid")
+    access_token = token_data.get("access_token")
+    openid = token_data.get("openid")
 
-        if access_token and openid:
-            try:
-                user_info_response = await client.get(
-                    "https://api.weixin.qq.com/sns/userinfo",
-                    params={"access_token": access_token, "openid": openid},
+    if access_token and openid:
+        try:
+            user_info_response = await client.get(
+                "https://api.weixin.qq.com/sns/userinfo",
+                params={"access_token": access_token, "openid": openid},
+            )
+            if user_info_response.status_code == status.HTTP_200_OK:
+                profile = WeChatProfile(
+                    **_parse_json_response(user_info_response, "wechat_profile")
                 )
-                if user_info_response.status_code == status.HTTP_200_OK:
-                    profile = WeChatProfile(
-                        **_parse_json_response(user_info_response, "wechat_profile")
-                    )
-            except httpx.HTTPError as exc:
-                logger.warning("wechat_profile_request_failed", error=str(exc))
+        except httpx.HTTPError as exc:
+            logger.warning("wechat_profile_request_failed", error=str(exc))
 
     credentials = WeChatCredentials(
         access_token=access_token,
@@ -2,9 +2,10 @@
 
 from __future__ import annotations
 
-from functools import lru_cache
+import hashlib
+from functools import cached_property, lru_cache
 from pathlib import Path
-from typing import Iterable, List, Optional
+from typing import FrozenSet, Iterable, List, Optional
 
 from pydantic import Field, field_validator
 from pydantic_settings import BaseSettings, SettingsConfigDict
@@ -57,6 +58,20 @@ class Settings(BaseSettings):
             return _split_csv(value)
         return [item for item in value if item]
 
+    @cached_property
+    def data_dir_resolved(self) -> Path:
+        return self.data_dir.resolve()
+
+    @cached_property
+    def api_key_digests(self) -> FrozenSet[bytes]:
+        """SHA-256 digests of the configured API keys.
+
+        Membership is checked on digests so the lookup stays O(1) without
+        comparing raw secrets byte by byte.
+        """
+
+        return frozenset(hash_api_key(key) for key in self.api_keys)
+
     @property
     def sqlite_path(self) -> Path:
         return self.data_dir / "memory.sqlite"
@@ -82,6 +97,10 @@ class Settings(BaseSettings):
         return self.max_upload_size_mb * 1024 * 1024
 
 
+def hash_api_key(key: str) -> bytes:
+    return hashlib.sha256(key.encode("utf-8")).digest()
+
+
 @lru_cache(maxsize=1)
 def get_settings() -> Settings:
     settings = Settings()
@@ -5,7 +5,7 @@ from __future__ import annotations
 from contextlib import contextmanager
 from typing import Generator
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import DeclarativeBase, Session, sessionmaker
 
 from .config import get_settings
@@ -17,8 +17,10 @@ class Base(DeclarativeBase):
 
 _settings = get_settings()
 
+_is_sqlite = _settings.resolved_database_url.startswith("sqlite")
+
 _connect_args = {}
-if _settings.resolved_database_url.startswith("sqlite"):
+if _is_sqlite:
     _connect_args = {"check_same_thread": False}
 
 engine = create_engine(
@@ -29,6 +31,21 @@ engine = create_engine(
     pool_pre_ping=True,
 )
 
+if _is_sqlite:
+
+    @event.listens_for(engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, _connection_record) -> None:  # pragma: no cover - driver hook
+        """Enable WAL so readers never block the writer, and enlarge page/mmap caches."""
+
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.execute("PRAGMA mmap_size=268435456")
+        cursor.execute("PRAGMA cache_size=-20000")
+        cursor.close()
+
+
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False, expire_on_commit=False)
 
 
@@ -2,16 +2,20 @@
 
 from __future__ import annotations
 
-import base64
-import binascii
+import asyncio
+import hashlib
 import logging
+import os
 import re
 import shutil
 import sys
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 from pathlib import Path
-from typing import Iterable, List, Optional
+from typing import AsyncIterator, Iterator, List, Optional
 from uuid import uuid4
 
+import orjson
 import structlog
 from fastapi import (
     BackgroundTasks,
@@ -20,18 +24,19 @@ from fastapi import (
     Header,
     HTTPException,
     Request,
+    UploadFile,
     status,
 )
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.responses import Response, StreamingResponse
 from pydantic import BaseModel, Field
 
 from .agent import run_agentic_pipeline, run_agentic_pipeline_stream
-from .auth import router as auth_router
-from .config import Settings, get_settings
+from .auth import close_http_client, router as auth_router
+from .config import Settings, get_settings, hash_api_key
 from .database import init_db
 from .memory import SQLiteMemory
-from .retriever import build_vector_store
+from .retriever import build_vector_store, bump_vector_store_version, close_ingest_pool
 
 
 def _configure_logging(settings: Settings) -> None:
@@ -65,7 +70,19 @@ init_db()
 
 logger = structlog.get_logger(__name__)
 
-app = FastAPI(title="DocChat AI API")
+
+@asynccontextmanager
+async def lifespan(_: FastAPI) -> AsyncIterator[None]:
+    # LLM calls and SQLite commits run via asyncio.to_thread; size the pool for that.
+    executor = ThreadPoolExecutor(max_workers=min(32, (os.cpu_count() or 1) * 4))
+    asyncio.get_running_loop().set_default_executor(executor)
+    yield
+    await close_http_client()
+    close_ingest_pool()
+    executor.shutdown(wait=False)
+
+
+app = FastAPI(title="DocChat AI API", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -77,6 +94,17 @@ app.add_middleware(
 
 memory = SQLiteMemory()
 
+# SSE 帧的固定字节片段，流式响应中直接拼接
+_SSE_DATA = b"data: "
+_SSE_DONE = b"data: [DONE]\n\n"
+_SSE_ERROR = "data: [错误] 对话生成失败\n\n".encode("utf-8")
+
+
+def _sse_frame(text: str) -> bytes:
+    """Encode one chunk as an SSE event, one ``data:`` line per payload line."""
+    lines = text.encode("utf-8").split(b"\n")
+    return b"".join(_SSE_DATA + line + b"\n" for line in lines) + b"\n"
+
 app.include_router(auth_router)
 
 
@@ -84,11 +112,6 @@ class ChatRequest(BaseModel):
     query: str = Field(..., min_length=1, max_length=2000)
 
 
-class PDFDocument(BaseModel):
-    filename: str = Field(..., min_length=1)
-    content: str = Field(..., description="Base64 encoded file content")
-
-
 def _extract_api_key(authorization: str | None, explicit_key: str | None) -> Optional[str]:
     if explicit_key:
         return explicit_key.strip()
@@ -100,52 +123,100 @@ def _extract_api_key(authorization: str | None, explicit_key: str | None) -> Opt
 async def require_api_key(
     authorization: str | None = Header(default=None),
     x_api_key: str | None = Header(default=None, alias="X-API-Key"),
-    settings: Settings = Depends(get_settings),
 ) -> None:
-    if not settings.api_keys:
+    # Settings are process-wide; read the module singleton instead of resolving
+    # ``get_settings`` as a sub-dependency on every request.
+    api_key_digests = settings.api_key_digests
+    if not api_key_digests:
         return
 
     candidate = _extract_api_key(authorization, x_api_key)
-    if candidate and candidate in settings.api_keys:
+    if candidate and hash_api_key(candidate) in api_key_digests:
         return
 
     raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid or missing API key")
 
 
+# Every character outside ``[A-Za-z0-9._-]`` becomes ``_``; compiled once at import.
+_UNSAFE_FILENAME_CHARS = re.compile(r"[^A-Za-z0-9._-]")
+
+
 def _sanitize_filename(filename: str, data_dir: Path) -> Path:
     base = Path(filename).name
-    if not base.lower().endswith(".pdf"):
+    if base[-4:].lower() != ".pdf":
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="仅支持 PDF 文件上传")
 
-    sanitized = re.sub(r"[^A-Za-z0-9._-]", "_", base)
-    candidate = data_dir / sanitized
-    if candidate.exists():
-        candidate = data_dir / f"{candidate.stem}_{uuid4().hex}{candidate.suffix}"
-    return candidate
+    sanitized = _UNSAFE_FILENAME_CHARS.sub("_", base)
+    return data_dir / sanitized
+
+
+_UPLOAD_CHUNK_SIZE = 64 * 1024
+_EXCLUSIVE_CREATE_FLAGS = os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, "O_BINARY", 0)
+
 
+def _create_exclusive(candidate: Path) -> tuple[Path, int]:
+    """Atomically create ``candidate``, falling back to a unique name if it is taken."""
 
-def _decode_document_content(document: PDFDocument) -> bytes:
     try:
-        return base64.b64decode(document.content, validate=True)
-    except (binascii.Error, ValueError) as exc:  # pragma: no cover - defensive
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"文件 {document.filename} 解码失败",
-        ) from exc
+        return candidate, os.open(candidate, _EXCLUSIVE_CREATE_FLAGS, 0o644)
+    except FileExistsError:
+        candidate = candidate.with_name(f"{candidate.stem}_{uuid4().hex}{candidate.suffix}")
+        return candidate, os.open(candidate, _EXCLUSIVE_CREATE_FLAGS, 0o644)
 
 
-def _validate_pdf_bytes(data: bytes, settings: Settings) -> None:
-    if len(data) > settings.max_upload_size_bytes:
+def _store_pdf_upload(upload: UploadFile, candidate: Path, settings: Settings) -> Path:
+    """Copy an uploaded PDF next to ``candidate`` chunk by chunk and return the stored path."""
+
+    # The multipart parser already knows the part size, so oversized files are
+    # rejected before any bytes are read back or written out.
+    if upload.size is not None and upload.size > settings.max_upload_size_bytes:
         raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail="文件过大")
 
-    if not data.startswith(b"%PDF"):
+    source = upload.file
+    chunk = source.read(_UPLOAD_CHUNK_SIZE)
+    if not chunk.startswith(b"%PDF"):
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="文件格式不是有效的 PDF")
 
+    path, fd = _create_exclusive(candidate)
+    written = 0
+    try:
+        with open(fd, "wb") as target:
+            while chunk:
+                written += len(chunk)
+                if written > settings.max_upload_size_bytes:
+                    raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail="文件过大")
+                target.write(chunk)
+                chunk = source.read(_UPLOAD_CHUNK_SIZE)
+    except BaseException:
+        path.unlink(missing_ok=True)
+        raise
+    return path
+
+
+def _iter_pdfs(data_dir: Path) -> Iterator[os.DirEntry]:
+    """Yield directory entries for the PDFs stored in ``data_dir``."""
+
+    try:
+        entries = os.scandir(data_dir)
+    except FileNotFoundError:
+        return
+    with entries:
+        for entry in entries:
+            if entry.name.endswith(".pdf") and entry.is_file():
+                yield entry
+
+
+_INTERNAL_ERROR_BODY = orjson.dumps({"detail": "服务器内部错误"})
+
 
 @app.exception_handler(Exception)
-async def handle_unexpected_error(request: Request, exc: Exception) -> JSONResponse:  # pragma: no cover - defensive
+async def handle_unexpected_error(request: Request, exc: Exception) -> Response:  # pragma: no cover - defensive
     logger.exception("unhandled_exception", path=str(request.url), error=str(exc))
-    return JSONResponse(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, content={"detail": "服务器内部错误"})
+    return Response(
+        content=_INTERNAL_ERROR_BODY,
+        status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+        media_type="application/json",
+    )
 
 
 @app.get("/health")
@@ -156,9 +227,9 @@ async def health() -> dict[str, str]:
 @app.post("/chat")
 async def chat(request: ChatRequest, _: None = Depends(require_api_key)) -> dict[str, str]:
     try:
-        memory.save("user", request.query)
-        response = run_agentic_pipeline(request.query)
-        memory.save("assistant", response)
+        response = await asyncio.to_thread(run_agentic_pipeline, request.query)
+        # 一次事务写入本轮问答，减少提交次数
+        await asyncio.to_thread(memory.save_many, [("user", request.query), ("assistant", response)])
         return {"response": response}
     except Exception as exc:  # pragma: no cover - 调用链防护
         logger.exception("chat_failed", error=str(exc))
@@ -167,40 +238,40 @@ async def chat(request: ChatRequest, _: None = Depends(require_api_key)) -> dict
 
 @app.post("/chat_stream")
 async def chat_stream(request: ChatRequest, _: None = Depends(require_api_key)) -> StreamingResponse:
-    memory.save("user", request.query)
+    # 问题在开始生成前写入，流失败或被客户端中断时也保留在记忆中
+    await asyncio.to_thread(memory.save, "user", request.query)
 
-    async def generate_response() -> Iterable[str]:
-        full_response = ""
+    async def generate_response() -> AsyncIterator[bytes]:
+        parts: list[str] = []
         try:
             async for chunk in run_agentic_pipeline_stream(request.query):
-                if chunk.startswith("data: ") and not chunk.endswith("[DONE]\n\n"):
-                    content = chunk[6:-2]
-                    full_response += content
-                yield chunk
+                parts.append(chunk)
+                yield _sse_frame(chunk)
         except Exception as exc:  # pragma: no cover - 调用链防护
             logger.exception("chat_stream_failed", error=str(exc))
-            yield "data: [错误] 对话生成失败\n\n"
+            yield _SSE_ERROR
         else:
-            memory.save("assistant", full_response)
+            yield _SSE_DONE
+            await asyncio.to_thread(memory.save, "assistant", "".join(parts))
 
     return StreamingResponse(
         generate_response(),
-        media_type="text/plain",
+        media_type="text/event-stream",
         headers={
             "Cache-Control": "no-cache",
             "Connection": "keep-alive",
-            "Content-Type": "text/plain; charset=utf-8",
+            "Content-Type": "text/event-stream; charset=utf-8",
         },
     )
 
 
 @app.post("/upload_pdfs")
 async def upload_pdfs(
-    files: List[PDFDocument],
+    files: List[UploadFile],
     background_tasks: BackgroundTasks,
     _: None = Depends(require_api_key),
     settings: Settings = Depends(get_settings),
-) -> dict[str, int]:
+) -> dict[str, int | str]:
     if not files:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="未提供任何文件")
 
@@ -208,11 +279,10 @@ async def upload_pdfs(
     data_dir = settings.data_dir
     data_dir.mkdir(parents=True, exist_ok=True)
 
-    for document in files:
-        file_bytes = _decode_document_content(document)
-        _validate_pdf_bytes(file_bytes, settings)
-        path = _sanitize_filename(document.filename, data_dir)
-        path.write_bytes(file_bytes)
+    for upload in files:
+        candidate = _sanitize_filename(upload.filename or "", data_dir)
+        # 分块写盘在工作线程中进行，不占用事件循环
+        path = await asyncio.to_thread(_store_pdf_upload, upload, candidate, settings)
         stored_paths.append(str(path))
 
     if stored_paths:
@@ -224,35 +294,50 @@ async def upload_pdfs(
 
 @app.post("/reset_memory")
 async def reset_memory(_: None = Depends(require_api_key)) -> dict[str, str]:
-    memory.reset()
+    await asyncio.to_thread(memory.reset)
     return {"status": "记忆已清空"}
 
 
-@app.get("/list_documents")
-async def list_documents(_: None = Depends(require_api_key)) -> dict[str, list[dict[str, float | str]]]:
-    documents: list[dict[str, float | str]] = []
-    if settings.data_dir.exists():
-        for file_path in settings.data_dir.glob("*.pdf"):
-            file_size = file_path.stat().st_size
-            documents.append(
-                {
-                    "filename": file_path.name,
-                    "size": file_size,
-                    "size_mb": round(file_size / (1024 * 1024), 2),
-                }
-            )
+@app.get("/list_documents", response_model=None)
+async def list_documents(
+    request: Request,
+    response: Response,
+    _: None = Depends(require_api_key),
+) -> dict[str, list[dict[str, float | str]]] | Response:
+    """List stored PDFs; answers ``304`` when the client's ETag still matches."""
 
+    documents: list[dict[str, float | str]] = []
+    fingerprint = hashlib.blake2b(digest_size=8)
+    for entry in _iter_pdfs(settings.data_dir_resolved):
+        stat_result = entry.stat()
+        file_size = stat_result.st_size
+        fingerprint.update(f"{entry.name}\0{file_size}\0{stat_result.st_mtime_ns}\n".encode("utf-8"))
+        documents.append(
+            {
+                "filename": entry.name,
+                "size": file_size,
+                "size_mb": round(file_size / (1024 * 1024), 2),
+            }
+        )
+
+    etag = f'"{fingerprint.hexdigest()}"'
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+    response.headers["ETag"] = etag
     return {"documents": documents}
 
 
 def _resolve_document_path(filename: str, data_dir: Path) -> Path:
+    """Resolve ``filename`` inside ``data_dir``, which must already be resolved."""
+
     target = data_dir / Path(filename).name
     try:
         target_resolved = target.resolve(strict=False)
     except FileNotFoundError:  # pragma: no cover - path doesn't exist yet
         target_resolved = target
 
-    if target_resolved.suffix.lower() != ".pdf" or target_resolved.parent.resolve() != data_dir.resolve():
+    if target_resolved.suffix.lower() != ".pdf" or target_resolved.parent != data_dir:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="无效的文件名")
 
     return target_resolved
@@ -264,18 +349,21 @@ async def delete_document(
     background_tasks: BackgroundTasks,
     _: None = Depends(require_api_key),
 ) -> dict[str, str]:
-    target = _resolve_document_path(filename, settings.data_dir)
+    target = _resolve_document_path(filename, settings.data_dir_resolved)
 
     if not target.exists():
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="文件不存在")
 
     target.unlink()
 
-    remaining_docs = [str(path) for path in settings.data_dir.glob("*.pdf")]
+    # 上传只为新文件建库，向量库不一定覆盖 data_dir 中的全部文档，
+    # 因此删除后按剩余的全部 PDF 重建，顺带修复两者之间的差异
+    remaining_docs = [entry.path for entry in _iter_pdfs(settings.data_dir_resolved)]
     if remaining_docs:
         background_tasks.add_task(build_vector_store, remaining_docs)
     elif settings.vector_db_path.exists():
         shutil.rmtree(settings.vector_db_path)
+        bump_vector_store_version()
 
     return {"status": "成功", "message": f"文档 {target.name} 已删除"}
 
@@ -286,12 +374,12 @@ async def clear_knowledge_base(_: None = Depends(require_api_key)) -> dict[str,
 
     if settings.vector_db_path.exists():
         shutil.rmtree(settings.vector_db_path)
+        bump_vector_store_version()
         removed.append("向量数据库")
 
-    if settings.data_dir.exists():
-        for pdf in settings.data_dir.glob("*.pdf"):
-            pdf.unlink()
-            removed.append(pdf.name)
+    for entry in _iter_pdfs(settings.data_dir_resolved):
+        os.unlink(entry.path)
+        removed.append(entry.name)
 
     if removed:
         return {"status": "知识库已清空", "message": f"已删除：{', '.join(removed)}"}
@@ -2,10 +2,10 @@
 
 from __future__ import annotations
 
-from datetime import datetime, timezone
+from datetime import datetime
 from typing import Iterable, List, Tuple
 
-from sqlalchemy import DateTime, Integer, String, Text, delete, select
+from sqlalchemy import DateTime, Integer, String, Text, delete, func, insert, select
 from sqlalchemy.orm import Mapped, Session, mapped_column
 
 from .database import Base, session_scope
@@ -17,8 +17,10 @@ class ChatMessage(Base):
     __tablename__ = "memory"
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    # Rendered inline as CURRENT_TIMESTAMP (UTC) so the database stamps each row
+    # without building a Python datetime per insert; works on existing tables too.
     timestamp: Mapped[datetime] = mapped_column(
-        DateTime(timezone=True), default=lambda: datetime.now(timezone.utc), nullable=False
+        DateTime(timezone=True), default=func.current_timestamp(), nullable=False
     )
     role: Mapped[str] = mapped_column(String(32), nullable=False)
     content: Mapped[str] = mapped_column(Text, nullable=False)
@@ -31,6 +33,15 @@ class SQLiteMemory:
         with session_scope() as session:
             session.add(ChatMessage(role=role, content=content))
 
+    def save_many(self, messages: Iterable[Tuple[str, str]]) -> None:
+        """Persist several messages with one bulk INSERT and a single commit."""
+
+        rows = [{"role": role, "content": content} for role, content in messages]
+        if not rows:
+            return
+        with session_scope() as session:
+            session.execute(insert(ChatMessage), rows)
+
     def load(self, limit: int = 20) -> List[Tuple[str, str]]:
         with session_scope() as session:
             return [(message.role, message.content) for message in self._latest_messages(session, limit)]
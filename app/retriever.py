@@ -1,12 +1,22 @@
 from __future__ import annotations
 
+import asyncio
+import heapq
 import math
+import multiprocessing
 import os
 import re
 import shutil
-from collections import defaultdict
+import tempfile
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+from itertools import chain
 from threading import Lock
+from typing import NamedTuple
 
+import numpy as np
 import structlog
 from PyPDF2 import PdfReader
 from langchain_chroma import Chroma
@@ -18,6 +28,30 @@ from .config import get_settings
 logger = structlog.get_logger(__name__)
 _settings = get_settings()
 _VECTOR_BUILD_LOCK = Lock()
+_vector_store_version = 0
+_VECTOR_INSERT_BATCH_SIZE = 256
+_INGEST_POOL_LOCK = Lock()
+_ingest_pool: ProcessPoolExecutor | None = None
+# 混合检索中语义检索使用的线程池（线程按需创建）
+_RETRIEVAL_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix="hybrid-retrieval")
+
+
+def get_vector_store_version() -> int:
+    """返回向量库版本号，每次重建或清空后递增，供上层缓存判断是否失效"""
+    return _vector_store_version
+
+
+def bump_vector_store_version() -> None:
+    """标记向量库内容已变化"""
+    global _vector_store_version
+    with _VECTOR_BUILD_LOCK:
+        _vector_store_version += 1
+
+# 文本清洗使用的正则，模块加载时编译一次
+_URL_RE = re.compile(r'http\S+|www\.\S+')
+_WEIBO_REPOST_RE = re.compile(r'//@[^:]+:')
+_WHITESPACE_RE = re.compile(r'\s+')
+_ASTRAL_RE = re.compile(r'[\U00010000-\U0010ffff]')
 
 # 改进的文本清洗函数
 def clean_text(text):
@@ -26,17 +60,34 @@ def clean_text(text):
         return ""
     
     # 移除URL链接
-    text = re.sub(r'http\S+|www\.\S+', '', text)
+    text = _URL_RE.sub('', text)
     # 移除微博转发标记
-    text = re.sub(r'//@[^:]+:', '', text)
-    # 移除特殊符号和多余空格
-    text = re.sub(r'[\n\r\t]+', ' ', text)
-    text = re.sub(r'\s+', ' ', text)
+    text = _WEIBO_REPOST_RE.sub('', text)
+    # 移除特殊符号和多余空格（换行、制表符同属空白，一并折叠）
+    text = _WHITESPACE_RE.sub(' ', text)
     # 移除表情符号和特殊字符
-    text = re.sub(r'[\U00010000-\U0010ffff]', '', text)
+    text = _ASTRAL_RE.sub('', text)
     
     return text.strip()
 
+# 内容质量过滤中视为“有意义”的字符：字母数字及常用中文标点
+_MEANINGFUL_PUNCTUATION = '，。！？；：'
+# 基本多文种平面内逐码点的查找表，按码点索引即可向量化计数
+_MEANINGFUL_BMP = np.fromiter(
+    (chr(cp).isalnum() or chr(cp) in _MEANINGFUL_PUNCTUATION for cp in range(0x10000)),
+    dtype=bool,
+    count=0x10000,
+)
+
+
+def _count_meaningful_chars(text):
+    """统计字母数字和中文标点的个数"""
+    codepoints = np.frombuffer(text.encode('utf-32-le', 'surrogatepass'), dtype=np.uint32)
+    if codepoints.size and codepoints.max() > 0xFFFF:
+        # 清洗后的文本不含辅助平面字符，这里仅作兜底
+        return len([c for c in text if c.isalnum() or c in _MEANINGFUL_PUNCTUATION])
+    return int(np.count_nonzero(_MEANINGFUL_BMP[codepoints]))
+
 # 改进的文本分割器，更适合中文内容
 text_splitter = RecursiveCharacterTextSplitter(
     chunk_size=800,  # 减小块大小，更适合中文
@@ -45,6 +96,36 @@ text_splitter = RecursiveCharacterTextSplitter(
     separators=["\n\n", "\n", ".", "。", "！", "？", ",", "，", " ", ""]
 )
 
+# 嵌入向量的维度布局
+_THEME_ORDER = ('创业', '管理', '产品', '技术', '字节跳动', '思考')
+_SEMANTIC_ORDER = ('创业经历', '管理理念', '技术看法')
+_LENGTH_DIMS = slice(0, 40)
+_DIVERSITY_DIMS = slice(40, 80)
+_THEME_DIMS = slice(80, 170)
+_SEMANTIC_DIMS = slice(170, 200)
+_IMPORTANCE_DIMS = slice(200, 220)
+_ZHANG_DIMS = slice(220, 244)
+_EMBEDDING_DIM = 244
+
+# 查询意图对应需要放大的维度区间及倍数
+_QUERY_INTENT_BOOSTS = {
+    '创业经历': ((slice(40, 130), 1.5), (slice(130, 160), 2.0)),
+    '管理理念': ((slice(55, 85), 1.5), (slice(160, 170), 2.0)),
+    '技术看法': ((slice(85, 115), 1.5), (slice(170, 180), 2.0)),
+}
+
+
+def _intent_scales(boosts):
+    """把维度区间倍数展开成整条向量的倍数，以及需要截断到1.0的维度掩码"""
+    scales = np.ones(_EMBEDDING_DIM, dtype=np.float32)
+    for dims, factor in boosts:
+        scales[dims] = factor
+    return scales, scales != 1.0
+
+
+# 查询时一次乘法完成意图增强
+_QUERY_INTENT_SCALES = {intent: _intent_scales(boosts) for intent, boosts in _QUERY_INTENT_BOOSTS.items()}
+
 # 改进的本地语义嵌入模型
 class ImprovedEmbeddings:
     def __init__(self):
@@ -67,58 +148,60 @@ class ImprovedEmbeddings:
             '管理理念': ['管理', '理念', '思想', '观点', '方法', '原则', '策略', '体系', '模式', '文化'],
             '技术看法': ['技术', '看法', '观点', '态度', '理解', '认识', '评价', '见解', '思考', '理念']
         }
+        
+        # 各类关键词去重后的并集，每段文本只需逐个检查一次
+        self._all_keywords = tuple(dict.fromkeys(
+            keyword
+            for keywords in (*self.themes.values(), *self.semantic_enhancement.values(), self.importance_keywords)
+            for keyword in keywords
+        ))
     
     def embed_documents(self, texts):
-        embeddings = []
-        for text in texts:
+        count = len(texts)
+        lengths = np.empty(count)
+        diversities = np.empty(count)
+        theme_scores = np.empty((count, len(_THEME_ORDER)))
+        semantic_scores = np.empty((count, len(_SEMANTIC_ORDER)))
+        importance_scores = np.empty(count)
+        zhang_related = np.empty(count)
+        
+        for row, text in enumerate(texts):
             # 计算文本的基本特征
             text_length = len(text)
-            char_diversity = len(set(text)) / max(1, text_length)
+            lengths[row] = text_length
+            diversities[row] = len(set(text)) / max(1, text_length)
+            
+            # 一次性找出文本中出现的全部关键词，后续得分只做集合查询
+            present = {keyword for keyword in self._all_keywords if keyword in text}
             
             # 计算主题相关性得分（增强版）
-            theme_scores = {}
-            for theme, keywords in self.themes.items():
+            for col, theme in enumerate(_THEME_ORDER):
+                keywords = self.themes[theme]
                 # 使用加权匹配，考虑关键词出现频率
-                matches = sum(1 for keyword in keywords if keyword in text)
+                matched = [keyword for keyword in keywords if keyword in present]
                 # 考虑关键词密度
-                density = sum(len(keyword) for keyword in keywords if keyword in text) / max(1, text_length)
-                theme_scores[theme] = (matches / len(keywords)) * 0.7 + density * 0.3
+                density = sum(map(len, matched)) / max(1, text_length)
+                theme_scores[row, col] = (len(matched) / len(keywords)) * 0.7 + density * 0.3
             
             # 计算语义增强得分
-            semantic_scores = {}
-            for semantic_type, keywords in self.semantic_enhancement.items():
-                matches = sum(1 for keyword in keywords if keyword in text)
-                semantic_scores[semantic_type] = matches / len(keywords)
+            for col, semantic_type in enumerate(_SEMANTIC_ORDER):
+                keywords = self.semantic_enhancement[semantic_type]
+                semantic_scores[row, col] = sum(1 for keyword in keywords if keyword in present) / len(keywords)
             
             # 计算重要性得分
-            importance_score = sum(1 for keyword in self.importance_keywords if keyword in text) / len(self.importance_keywords)
+            importance_scores[row] = sum(1 for keyword in self.importance_keywords if keyword in present) / len(self.importance_keywords)
             
             # 计算张一鸣相关度（特殊处理）
-            zhang_related = 1.0 if '张一鸣' in text else 0.0
-            
-            # 生成384维嵌入向量（增强版）
-            base_vector = [text_length / 1000.0] * 40  # 长度特征
-            diversity_vector = [char_diversity] * 40  # 多样性特征
-            
-            # 主题特征向量
-            theme_vector = []
-            for theme in ['创业', '管理', '产品', '技术', '字节跳动', '思考']:
-                theme_vector.extend([theme_scores.get(theme, 0)] * 15)
-            
-            # 语义增强特征向量
-            semantic_vector = []
-            for semantic_type in ['创业经历', '管理理念', '技术看法']:
-                semantic_vector.extend([semantic_scores.get(semantic_type, 0)] * 10)
-            
-            # 重要性特征向量
-            importance_vector = [importance_score] * 20
-            
-            # 张一鸣相关度特征
-            zhang_vector = [zhang_related] * 24
-            
-            embedding = base_vector + diversity_vector + theme_vector + semantic_vector + importance_vector + zhang_vector
-            embeddings.append(embedding)
-        
+            zhang_related[row] = 1.0 if '张一鸣' in text else 0.0
+        
+        # 按固定维度区间批量写入嵌入矩阵：长度、多样性、主题、语义增强、重要性、张一鸣相关度
+        embeddings = np.empty((count, _EMBEDDING_DIM), dtype=np.float32)
+        embeddings[:, _LENGTH_DIMS] = (lengths / 1000.0)[:, None]
+        embeddings[:, _DIVERSITY_DIMS] = diversities[:, None]
+        embeddings[:, _THEME_DIMS] = np.repeat(theme_scores, 15, axis=1)
+        embeddings[:, _SEMANTIC_DIMS] = np.repeat(semantic_scores, 10, axis=1)
+        embeddings[:, _IMPORTANCE_DIMS] = importance_scores[:, None]
+        embeddings[:, _ZHANG_DIMS] = zhang_related[:, None]
         return embeddings
     
     def embed_query(self, text):
@@ -129,25 +212,12 @@ class ImprovedEmbeddings:
         # 生成基础嵌入
         base_embedding = self.embed_documents([text])[0]
         
-        # 根据查询意图增强相关维度
-        if query_intent == '创业经历':
-            # 增强创业相关维度的权重
-            for i in range(40, 130):  # 创业主题相关维度
-                base_embedding[i] = min(base_embedding[i] * 1.5, 1.0)
-            for i in range(130, 160):  # 创业经历语义维度
-                base_embedding[i] = min(base_embedding[i] * 2.0, 1.0)
-        elif query_intent == '管理理念':
-            # 增强管理相关维度的权重
-            for i in range(55, 85):  # 管理主题相关维度
-                base_embedding[i] = min(base_embedding[i] * 1.5, 1.0)
-            for i in range(160, 170):  # 管理理念语义维度
-                base_embedding[i] = min(base_embedding[i] * 2.0, 1.0)
-        elif query_intent == '技术看法':
-            # 增强技术相关维度的权重
-            for i in range(85, 115):  # 技术主题相关维度
-                base_embedding[i] = min(base_embedding[i] * 1.5, 1.0)
-            for i in range(170, 180):  # 技术看法语义维度
-                base_embedding[i] = min(base_embedding[i] * 2.0, 1.0)
+        # 根据查询意图增强相关维度的权重
+        intent_scales = _QUERY_INTENT_SCALES.get(query_intent)
+        if intent_scales is not None:
+            scales, boosted = intent_scales
+            # 只对被放大的维度截断到1.0，其余维度保持原值
+            np.minimum(base_embedding * scales, 1.0, out=base_embedding, where=boosted)
         
         return base_embedding
     
@@ -164,136 +234,231 @@ class ImprovedEmbeddings:
         
         return 'general'
 
+@lru_cache(maxsize=1)
 def get_embeddings():
-    """获取改进的本地语义嵌入模型"""
+    """获取改进的本地语义嵌入模型（无状态，进程内共享一个实例）"""
     return ImprovedEmbeddings()
 
+def _extract_and_chunk(fpath: str) -> list[Document]:
+    """读取单个PDF，清洗、分块并过滤低质量内容（可在子进程中执行）"""
+    docs = []
+    reader = PdfReader(fpath)
+    for page_num, page in enumerate(reader.pages):
+        text = page.extract_text()
+        if text:
+            # 清洗文本内容
+            cleaned_text = clean_text(text)
+            
+            # 使用文本分割器将页面内容分割成多个块
+            page_docs = text_splitter.split_text(cleaned_text)
+            for chunk_num, chunk in enumerate(page_docs):
+                # 更严格的内容质量过滤
+                if len(chunk.strip()) > 100:  # 增加最小长度要求
+                    # 检查内容质量（避免包含过多无意义字符）
+                    meaningful_chars = _count_meaningful_chars(chunk)
+                    if meaningful_chars / len(chunk) > 0.6:  # 有意义字符比例超过60%
+                        docs.append(Document(
+                            page_content=chunk, 
+                            metadata={
+                                "source": os.path.basename(fpath),
+                                "page": page_num + 1,
+                                "chunk": chunk_num + 1
+                            }
+                        ))
+    return docs
+
+
+def _get_ingest_pool() -> ProcessPoolExecutor:
+    """延迟创建PDF解析进程池，多次入库复用同一批子进程"""
+    global _ingest_pool
+    with _INGEST_POOL_LOCK:
+        if _ingest_pool is None:
+            # spawn 避免在多线程的服务进程中 fork
+            _ingest_pool = ProcessPoolExecutor(
+                max_workers=os.cpu_count() or 1,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _ingest_pool
+
+
+def close_ingest_pool() -> None:
+    global _ingest_pool
+    with _INGEST_POOL_LOCK:
+        if _ingest_pool is not None:
+            _ingest_pool.shutdown(wait=False, cancel_futures=True)
+            _ingest_pool = None
+
+
+def _discard_ingest_pool(pool: ProcessPoolExecutor) -> None:
+    """丢弃已损坏的进程池，下次入库时重新创建；其他线程已替换过时不再处理"""
+    global _ingest_pool
+    with _INGEST_POOL_LOCK:
+        if _ingest_pool is pool:
+            _ingest_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _parse_files(files: list[str]) -> list[Document]:
+    """解析全部PDF并返回文档块，多个文件时按文件并行解析，单个文件直接在当前线程处理"""
+    if len(files) <= 1:
+        return list(chain.from_iterable(map(_extract_and_chunk, files)))
+
+    # 子进程异常退出（内存不足、解析器崩溃）会使整个进程池不可用，换新进程池重试一次
+    for attempt in range(2):
+        pool = _get_ingest_pool()
+        try:
+            return list(chain.from_iterable(pool.map(_extract_and_chunk, files)))
+        except BrokenProcessPool:
+            _discard_ingest_pool(pool)
+            if attempt:
+                raise
+            logger.warning("ingest_pool_broken", files=len(files))
+
+
 def build_vector_store(files: list[str]) -> None:
     vector_dir = _settings.vector_db_path
-    vector_dir.mkdir(parents=True, exist_ok=True)
-    docs = []
+    vector_dir.parent.mkdir(parents=True, exist_ok=True)
 
-    for fpath in files:
-        reader = PdfReader(fpath)
-        for page_num, page in enumerate(reader.pages):
-            text = page.extract_text()
-            if text:
-                # 清洗文本内容
-                cleaned_text = clean_text(text)
-                
-                # 使用文本分割器将页面内容分割成多个块
-                page_docs = text_splitter.split_text(cleaned_text)
-                for chunk_num, chunk in enumerate(page_docs):
-                    # 更严格的内容质量过滤
-                    if len(chunk.strip()) > 100:  # 增加最小长度要求
-                        # 检查内容质量（避免包含过多无意义字符）
-                        meaningful_chars = len([c for c in chunk if c.isalnum() or c in '，。！？；：'])
-                        if meaningful_chars / len(chunk) > 0.6:  # 有意义字符比例超过60%
-                            docs.append(Document(
-                                page_content=chunk, 
-                                metadata={
-                                    "source": os.path.basename(fpath),
-                                    "page": page_num + 1,
-                                    "chunk": chunk_num + 1
-                                }
-                            ))
-    
-    if not docs:
-        logger.warning("vector_store_empty", reason="no_documents")
-        return
+    # 加锁前完成解析，CPU密集的解析不阻塞其他入库请求
+    docs = _parse_files(files)
 
     # 使用DeepSeek语义嵌入模型
     embeddings = get_embeddings()
+    store = None
+    total = 0
+    samples = []
 
     with _VECTOR_BUILD_LOCK:
-        if vector_dir.exists():
-            shutil.rmtree(vector_dir)
+        # 先写入同级临时目录，全部批次成功后再替换旧库，解析或嵌入失败时旧库保持不变
+        build_dir = tempfile.mkdtemp(prefix=f"{vector_dir.name}.", dir=vector_dir.parent)
+        try:
+            # 分批写入向量库，控制单次嵌入请求的大小
+            for start in range(0, len(docs), _VECTOR_INSERT_BATCH_SIZE):
+                batch = docs[start:start + _VECTOR_INSERT_BATCH_SIZE]
+                if store is None:
+                    store = Chroma(persist_directory=build_dir, embedding_function=embeddings)
+                    samples = [doc.page_content[:200] for doc in batch[:3]]
+                store.add_documents(batch)
+                total += len(batch)
 
-        Chroma.from_documents(docs, embeddings, persist_directory=str(vector_dir))
+            # 没有可用内容时保留原有向量库
+            if store is not None:
+                if vector_dir.exists():
+                    shutil.rmtree(vector_dir)
+                os.replace(build_dir, vector_dir)
+        finally:
+            shutil.rmtree(build_dir, ignore_errors=True)
 
-    logger.info("vector_store_built", document_chunks=len(docs))
-    
-    if docs:
-        logger.debug(
-            "vector_store_sample",
-            samples=[doc.page_content[:200] for doc in docs[:3]],
-        )
+    if store is None:
+        logger.warning("vector_store_empty", reason="no_documents")
+        return
+
+    bump_vector_store_version()
+    logger.info("vector_store_built", document_chunks=total)
+    logger.debug("vector_store_sample", samples=samples)
 
-    return store
 
 # BM25关键词检索器
 class BM25Retriever:
-    def __init__(self, documents, k1=1.5, b=0.75):
-        self.documents = documents
+    def __init__(self, texts, metadatas=None, k1=1.5, b=0.75):
+        # 只保留原始文本和元数据，命中的结果在检索时才构造 Document
+        self.texts = texts
+        self.metadatas = metadatas if metadatas is not None else [{} for _ in texts]
         self.k1 = k1
         self.b = b
-        self.avg_doc_len = sum(len(doc.page_content.split()) for doc in documents) / len(documents)
-        self.doc_lengths = [len(doc.page_content.split()) for doc in documents]
-        self.vocab = self._build_vocab()
-        self.idf = self._compute_idf()
-        
-    def _build_vocab(self):
-        """构建词汇表"""
-        vocab = defaultdict(set)
-        for i, doc in enumerate(self.documents):
-            words = self._tokenize(doc.page_content)
-            for word in words:
-                vocab[word].add(i)
-        return vocab
+        self.doc_lengths = np.fromiter((len(text.split()) for text in texts), dtype=np.int32, count=len(texts))
+        self.avg_doc_len = self.doc_lengths.mean()
+        # 文档长度归一项只与文档有关，预先算好
+        self._length_norm = k1 * (1 - b + b * self.doc_lengths / self.avg_doc_len)
+        self._build_postings()
+        
+    def _build_postings(self):
+        """一次性构建CSR格式的倒排索引和IDF
+
+        以字符为词（跳过空白字符），所有文档的码点拼接后按 (词ID, 文档) 去重计数，
+        得到按词ID排序的 postings_docs / postings_tf，postings_indptr 为各词的区间起点。
+        """
+        n = len(self.texts)
+        codepoints = [
+            np.frombuffer(text.encode('utf-32-le', 'surrogatepass'), dtype=np.uint32)
+            for text in self.texts
+        ]
+        all_codepoints = np.concatenate(codepoints)
+        all_doc_ids = np.repeat(np.arange(n), [len(cps) for cps in codepoints])
+        
+        vocab, token_ids = np.unique(all_codepoints, return_inverse=True)
+        is_word = np.array([not chr(cp).isspace() for cp in vocab.tolist()], dtype=bool)
+        remap = np.cumsum(is_word) - 1
+        keep = is_word[token_ids]
+        vocab = vocab[is_word]
+        
+        pair_keys, tf = np.unique(remap[token_ids[keep]] * n + all_doc_ids[keep], return_counts=True)
+        pair_tokens, pair_docs = np.divmod(pair_keys, n)
+        
+        self.token_ids = {chr(cp): i for i, cp in enumerate(vocab.tolist())}
+        self.postings_indptr = np.searchsorted(pair_tokens, np.arange(len(vocab) + 1))
+        # 倒排表按最小够用的整数类型存储，计算得分时再提升为 float64
+        self.postings_docs = pair_docs.astype(np.int32)
+        self.postings_tf = tf.astype(np.uint32)
+        df = np.diff(self.postings_indptr)
+        self.idf = np.log((n - df + 0.5) / (df + 0.5) + 1)
     
     def _tokenize(self, text):
         """中文分词（简化版）"""
         # 使用简单的字符分割，实际应用中可以使用jieba等分词工具
         return [char for char in text if char.strip()]
     
-    def _compute_idf(self):
-        """计算逆文档频率"""
-        idf = {}
-        n = len(self.documents)
-        for word, doc_indices in self.vocab.items():
-            df = len(doc_indices)
-            idf[word] = math.log((n - df + 0.5) / (df + 0.5) + 1)
-        return idf
-    
-    def _compute_bm25_score(self, query, doc_index):
-        """计算BM25得分"""
-        query_words = self._tokenize(query)
-        doc_words = self._tokenize(self.documents[doc_index].page_content)
-        doc_len = self.doc_lengths[doc_index]
-        
-        score = 0
-        for word in query_words:
-            if word not in self.vocab:
+    def _compute_bm25_scores(self, query):
+        """按查询词遍历倒排表，一次算出所有文档的BM25得分"""
+        scores = np.zeros(len(self.texts))
+        indptr = self.postings_indptr
+        # 重复的查询词只遍历一次倒排表，按出现次数加权
+        for word, weight in Counter(self._tokenize(query)).items():
+            token = self.token_ids.get(word)
+            if token is None:
                 continue
-                
-            # 计算词频
-            tf = doc_words.count(word)
-            if tf == 0:
-                continue
-                
+            lo, hi = indptr[token], indptr[token + 1]
+            doc_ids = self.postings_docs[lo:hi]
+            tf = self.postings_tf[lo:hi]
             # BM25公式
-            idf = self.idf[word]
-            numerator = tf * (self.k1 + 1)
-            denominator = tf + self.k1 * (1 - self.b + self.b * doc_len / self.avg_doc_len)
-            score += idf * numerator / denominator
-        
-        return score
+            scores[doc_ids] += weight * self.idf[token] * (tf * (self.k1 + 1)) / (tf + self._length_norm[doc_ids])
+        return scores
     
     def retrieve(self, query, k=10):
         """检索相关文档"""
-        scores = []
-        for i in range(len(self.documents)):
-            score = self._compute_bm25_score(query, i)
-            if score > 0:
-                scores.append((score, self.documents[i]))
-        
-        # 按得分排序
-        scores.sort(key=lambda x: x[0], reverse=True)
-        return [doc for score, doc in scores[:k]]
+        scores = self._compute_bm25_scores(query)
+        matched = np.flatnonzero(scores > 0)
+        if len(matched) > k > 0:
+            # 先用 partition 找到第k高的得分，只保留不低于它的文档（含同分）再排序
+            kth_score = np.partition(scores[matched], len(matched) - k)[len(matched) - k]
+            matched = matched[scores[matched] >= kth_score]
+        
+        # 按得分排序，同分保持文档原有顺序
+        ranked = matched[np.argsort(-scores[matched], kind='stable')[:k]]
+        return [Document(page_content=self.texts[i], metadata=self.metadatas[i]) for i in ranked]
 
 # 重排序器
+class RerankFeatures(NamedTuple):
+    """文档中与查询无关的重排序特征，每段内容只计算一次"""
+    chars: frozenset
+    keywords: frozenset
+    intents: tuple
+    length: int
+    spam_penalty: float
+
+
+# 关键词匹配使用的重要关键词
+_IMPORTANT_KEYWORDS = ('张一鸣', '创业', '字节跳动', '今日头条', '抖音', '管理', '技术')
+# 查询意图 -> 内容中对应的相关词
+_INTENT_WORDS = (
+    ('创业', ('创业', '公司', '产品', '市场')),
+    ('管理', ('管理', '团队', '组织', '文化')),
+    ('技术', ('技术', '算法', 'AI', '开发')),
+)
+
+
 class Reranker:
-    def __init__(self):
+    def __init__(self, feature_cache_size=4096):
         # 重排序权重配置（优化版）
         self.weights = {
             'semantic_score': 0.35,
@@ -308,25 +473,53 @@ class Reranker:
             '添加微信', '领取', '创业项目', '互联网创业', '200个',
             '货比三家', '搜一下就不会上当', '保证年收益率', '管理费用'
         ]
+        
+        # 重要关键词、意图相关词和垃圾关键词去重后的并集，每段内容只逐个检查一次
+        self._scan_keywords = tuple(dict.fromkeys(chain(
+            _IMPORTANT_KEYWORDS,
+            chain.from_iterable(words for _, words in _INTENT_WORDS),
+            self.spam_keywords,
+        )))
+        
+        # 同一段内容在多次查询中反复出现，按内容缓存其特征
+        self._features = lru_cache(maxsize=feature_cache_size)(self._extract_features)
     
     def compute_relevance_score(self, query, document):
         """计算文档与查询的相关性得分"""
-        content = document.page_content
+        return self._score(self._query_profile(query), self._features(document.page_content))
+    
+    def _query_profile(self, query):
+        """提取查询侧特征：字符集合、命中的重要关键词、查询意图"""
+        query_chars = frozenset(char for char in query if char.strip())
+        query_keywords = [keyword for keyword in _IMPORTANT_KEYWORDS if keyword in query]
+        query_intents = [intent for intent, _ in _INTENT_WORDS if intent in query]
+        return query_chars, query_keywords, query_intents
+    
+    def _extract_features(self, content):
+        # 一次性找出内容中出现的全部关键词，各项特征只做集合查询
+        present = {keyword for keyword in self._scan_keywords if keyword in content}
+        return RerankFeatures(
+            chars=frozenset(char for char in content if char.strip()),
+            keywords=frozenset(keyword for keyword in _IMPORTANT_KEYWORDS if keyword in present),
+            intents=tuple(intent for intent, words in _INTENT_WORDS if any(word in present for word in words)),
+            length=len(content),
+            spam_penalty=self._detect_spam_content(present),
+        )
+    
+    def _score(self, query_profile, features):
+        query_chars, query_keywords, query_intents = query_profile
         
-        # 语义相似性得分（基于现有嵌入模型）
-        semantic_score = self._compute_semantic_score(query, content)
+        # 语义相似性得分（查询字符在内容中的覆盖率）
+        semantic_score = len(query_chars & features.chars) / len(query_chars) if query_chars else 0
         
         # 关键词匹配得分
-        keyword_score = self._compute_keyword_score(query, content)
+        keyword_score = min(sum(1 for keyword in query_keywords if keyword in features.keywords) / 3, 1.0)  # 归一化到0-1
         
         # 相关性增强得分
-        relevance_boost = self._compute_relevance_boost(query, content)
+        relevance_boost = self._compute_relevance_boost(query_intents, features)
         
         # 文档质量得分
-        quality_score = self._compute_quality_score(content)
-        
-        # 垃圾信息检测
-        spam_penalty = self._detect_spam_content(content)
+        quality_score = self._compute_quality_score(features.length)
         
         # 综合得分
         total_score = (
@@ -334,66 +527,40 @@ class Reranker:
             keyword_score * self.weights['keyword_score'] +
             relevance_boost * self.weights['relevance_boost'] +
             quality_score * self.weights['quality_score'] +
-            spam_penalty * self.weights['spam_penalty']
+            features.spam_penalty * self.weights['spam_penalty']
         )
         
         # 确保得分在合理范围内
         return max(0, min(total_score, 1.0))
     
-    def _compute_semantic_score(self, query, content):
-        """计算语义相似性得分"""
-        query_words = set([char for char in query if char.strip()])
-        content_words = set([char for char in content if char.strip()])
-        
-        if not query_words:
-            return 0
-        
-        intersection = query_words.intersection(content_words)
-        return len(intersection) / len(query_words)
-    
-    def _compute_keyword_score(self, query, content):
-        """计算关键词匹配得分"""
-        # 重要关键词列表
-        important_keywords = ['张一鸣', '创业', '字节跳动', '今日头条', '抖音', '管理', '技术']
-        
-        score = 0
-        for keyword in important_keywords:
-            if keyword in query and keyword in content:
-                score += 1
-        
-        return min(score / 3, 1.0)  # 归一化到0-1
-    
-    def _compute_relevance_boost(self, query, content):
+    def _compute_relevance_boost(self, query_intents, features):
         """计算相关性增强得分"""
         boost = 0
         
         # 查询意图匹配
-        if '创业' in query and any(word in content for word in ['创业', '公司', '产品', '市场']):
-            boost += 0.3
-        if '管理' in query and any(word in content for word in ['管理', '团队', '组织', '文化']):
-            boost += 0.3
-        if '技术' in query and any(word in content for word in ['技术', '算法', 'AI', '开发']):
-            boost += 0.3
+        for intent in query_intents:
+            if intent in features.intents:
+                boost += 0.3
         
         # 上下文相关性
-        if len(content) > 200:  # 较长内容通常更有价值
+        if features.length > 200:  # 较长内容通常更有价值
             boost += 0.1
         
         return min(boost, 1.0)
     
-    def _compute_quality_score(self, content):
+    def _compute_quality_score(self, length):
         """计算内容质量得分"""
         # 基于内容长度和多样性
-        if len(content) < 50:
+        if length < 50:
             return 0.2
-        elif len(content) < 100:
+        elif length < 100:
             return 0.5
         else:
             return 0.8
     
-    def _detect_spam_content(self, content):
-        """检测垃圾信息，返回惩罚系数（0-1）"""
-        spam_count = sum(1 for keyword in self.spam_keywords if keyword in content)
+    def _detect_spam_content(self, present_keywords):
+        """根据内容中出现的关键词检测垃圾信息，返回惩罚系数（0-1）"""
+        spam_count = sum(1 for keyword in self.spam_keywords if keyword in present_keywords)
         
         # 如果有垃圾信息关键词，给予惩罚
         if spam_count > 0:
@@ -403,15 +570,20 @@ class Reranker:
         
         return 0.0
     
-    def rerank(self, query, documents):
-        """对文档进行重排序"""
+    def rerank(self, query, documents, k=None):
+        """对文档进行重排序，指定k时只返回得分最高的k个"""
+        # 查询侧特征只计算一次
+        query_profile = self._query_profile(query)
         scored_docs = []
         for doc in documents:
-            score = self.compute_relevance_score(query, doc)
+            score = self._score(query_profile, self._features(doc.page_content))
             scored_docs.append((score, doc))
         
         # 按得分排序
-        scored_docs.sort(key=lambda x: x[0], reverse=True)
+        if k is not None:
+            scored_docs = heapq.nlargest(k, scored_docs, key=lambda x: x[0])
+        else:
+            scored_docs.sort(key=lambda x: x[0], reverse=True)
         return [doc for score, doc in scored_docs]
 
 # Hybrid + Rerank检索器
@@ -423,61 +595,116 @@ class HybridRerankRetriever:
     
     def invoke(self, query, k=10):
         """执行混合检索"""
-        # 1. 语义检索
-        semantic_docs = self.semantic_retriever.invoke(query)
+        # 1. 语义检索提交到线程池，与关键词检索并行
+        semantic_future = _RETRIEVAL_POOL.submit(self.semantic_retriever.invoke, query)
         
-        # 2. 关键词检索
+        # 2. 关键词检索在当前线程执行
         bm25_docs = self.bm25_retriever.retrieve(query, k=k)
+        semantic_docs = semantic_future.result()
         
         # 3. 合并结果并去重
         all_docs = self._merge_and_deduplicate(semantic_docs, bm25_docs)
         
         # 4. 重排序
-        reranked_docs = self.reranker.rerank(query, all_docs)
-        
-        return reranked_docs[:k]
+        return self.reranker.rerank(query, all_docs, k=k)
     
     def _merge_and_deduplicate(self, semantic_docs, bm25_docs):
         """合并并去重文档"""
-        seen_content = set()
-        merged_docs = []
-        
-        # 添加语义检索结果
-        for doc in semantic_docs:
-            content_hash = hash(doc.page_content[:100])  # 使用前100字符作为去重依据
-            if content_hash not in seen_content:
-                seen_content.add(content_hash)
-                merged_docs.append(doc)
-        
-        # 添加关键词检索结果
-        for doc in bm25_docs:
-            content_hash = hash(doc.page_content[:100])
-            if content_hash not in seen_content:
-                seen_content.add(content_hash)
-                merged_docs.append(doc)
-        
-        return merged_docs
+        # 以前100字符作为去重依据，语义检索结果优先，保持先到先得的顺序
+        merged_docs = {}
+        for doc in chain(semantic_docs, bm25_docs):
+            merged_docs.setdefault(doc.page_content[:100], doc)
+        return list(merged_docs.values())
+
+# 微批次检索器：并发请求在短窗口内合并为一次 batch 调用
+class BatchingRetriever:
+    def __init__(self, retriever_factory, max_batch=32, window_ms=8):
+        self.retriever_factory = retriever_factory
+        self.max_batch = max_batch
+        self.window = window_ms / 1000
+        self._queue = None
+        self._worker = None
+    
+    async def submit(self, query):
+        """提交查询并等待所在批次的检索结果"""
+        loop = asyncio.get_running_loop()
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._worker = loop.create_task(self._run(self._queue))
+        
+        future = loop.create_future()
+        self._queue.put_nowait((query, future))
+        return await future
+    
+    async def _run(self, queue):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await queue.get()]
+            
+            # 在窗口期内继续收集排队的查询
+            deadline = loop.time() + self.window
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            
+            queries = [query for query, _ in batch]
+            try:
+                retriever = self.retriever_factory()
+                results = await asyncio.to_thread(retriever.batch, queries)
+            except Exception as exc:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(exc)
+            else:
+                for (_, future), docs in zip(batch, results):
+                    if not future.done():
+                        future.set_result(docs)
+
+def _vector_store_key():
+    """向量库的缓存键：进程内版本号加目录的 inode/mtime
+
+    版本号覆盖本进程内的重建、删除；目录被其他进程整体重建时 inode 或 mtime 也会变化。
+    """
+    try:
+        stat = os.stat(_settings.vector_db_path)
+    except FileNotFoundError:
+        return (_vector_store_version, None, None)
+    return (_vector_store_version, stat.st_ino, stat.st_mtime_ns)
+
 
 def get_retriever():
+    """返回缓存的语义检索器，向量库变化后自动重新打开"""
+    return _load_retriever(_vector_store_key())
+
+
+def get_hybrid_rerank_retriever():
+    """获取Hybrid + Rerank检索器，BM25索引随向量库版本缓存"""
+    return _load_hybrid_rerank_retriever(_vector_store_key())
+
+
+@lru_cache(maxsize=1)
+def _load_retriever(_key):
     # 使用DeepSeek语义嵌入模型
     embeddings = get_embeddings()
     return Chroma(persist_directory=str(_settings.vector_db_path), embedding_function=embeddings).as_retriever(search_kwargs={"k": 10})  # 增加检索数量
 
-def get_hybrid_rerank_retriever():
-    """获取Hybrid + Rerank检索器"""
-    # 1. 获取语义检索器
+@lru_cache(maxsize=1)
+def _load_hybrid_rerank_retriever(_key):
+    # 1. 打开一次向量库，语义检索与BM25共用
     embeddings = get_embeddings()
-    semantic_retriever = Chroma(persist_directory=str(_settings.vector_db_path), embedding_function=embeddings).as_retriever(search_kwargs={"k": 15})
-
-    # 2. 获取所有文档用于BM25检索器
     store = Chroma(persist_directory=str(_settings.vector_db_path), embedding_function=embeddings)
-    all_docs = store.get()
-    documents = []
-    for i, (doc_content, metadata) in enumerate(zip(all_docs['documents'], all_docs['metadatas'])):
-        documents.append(Document(page_content=doc_content, metadata=metadata))
+    semantic_retriever = store.as_retriever(search_kwargs={"k": 15})
+
+    # 2. 读取全部文本和元数据用于BM25检索器
+    all_docs = store.get(include=["documents", "metadatas"])
     
     # 3. 创建BM25检索器
-    bm25_retriever = BM25Retriever(documents)
+    bm25_retriever = BM25Retriever(all_docs['documents'], all_docs['metadatas'])
     
     # 4. 创建重排序器
     reranker = Reranker()
@@ -1,11 +1,38 @@
 from langchain.tools import tool
-import requests, math
+import ast, requests, math
+from functools import lru_cache
 from .retriever import get_retriever
 
+_CALC_NAMES = {"abs": abs, "round": round, "math": math}
+_CALC_NODES = (
+    ast.Expression, ast.BinOp, ast.UnaryOp, ast.operator, ast.unaryop,
+    ast.Constant, ast.Name, ast.Attribute, ast.Call, ast.keyword, ast.Load,
+)
+
+def _validate_calc_node(node):
+    if not isinstance(node, _CALC_NODES):
+        raise ValueError(f"不支持的表达式: {type(node).__name__}")
+    if isinstance(node, ast.Constant) and not isinstance(node.value, (int, float, complex)):
+        raise ValueError("只支持数字常量")
+    if isinstance(node, ast.Name) and node.id not in _CALC_NAMES:
+        raise ValueError(f"未知名称: {node.id}")
+    if isinstance(node, ast.Attribute) and (
+        not isinstance(node.value, ast.Name) or node.value.id != "math" or node.attr.startswith("_")
+    ):
+        raise ValueError("只允许访问 math 模块的公开函数和常量")
+    for child in ast.iter_child_nodes(node):
+        _validate_calc_node(child)
+
+@lru_cache(maxsize=256)
+def _compile_expression(expression: str):
+    tree = ast.parse(expression, mode="eval")
+    _validate_calc_node(tree)
+    return compile(tree, "<calc>", "eval")
+
 @tool
 def calculator(expression: str) -> str:
     try:
-        result = eval(expression, {"__builtins__": {"abs": abs, "round": round, "math": math}})
+        result = eval(_compile_expression(expression), {"__builtins__": {}}, _CALC_NAMES)
         return f"结果是：{result}"
     except Exception as e:
         return f"计算错误: {e}"
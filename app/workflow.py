@@ -1,11 +1,16 @@
 from __future__ import annotations
 
-from typing import List, TypedDict
+import hashlib
+from collections import OrderedDict
+from functools import lru_cache
+from itertools import chain, islice
+from threading import Lock
+from typing import List, Tuple, TypedDict
 
 import structlog
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_openai import ChatOpenAI
-from langgraph.graph import StateGraph
+from langgraph.graph import END, StateGraph
 
 from .config import get_settings
 from .retriever import get_hybrid_rerank_retriever, get_retriever
@@ -27,6 +32,154 @@ def _require_api_key() -> str:
         raise RuntimeError("未能找到 DeepSeek API Key，请在环境变量中配置 DEEPSEEK_API_KEY")
     return api_key
 
+@lru_cache(maxsize=8)
+def _get_llm(api_key: str, base_url: str, temperature: float, streaming: bool = False) -> ChatOpenAI:
+    """Return a shared DeepSeek chat client so its HTTP pool is reused across requests."""
+
+    return ChatOpenAI(
+        model="deepseek-chat",
+        api_key=api_key,
+        base_url=base_url,
+        temperature=temperature,
+        streaming=streaming,
+    )
+
+
+@lru_cache(maxsize=16)
+def _get_prompt(template: str) -> ChatPromptTemplate:
+    """Parse each constant prompt template once."""
+
+    return ChatPromptTemplate.from_template(template)
+
+# 回答提示模板：按查询主题选择人设和专属要求，通用格式要求只维护一份
+_RESPONSE_PROMPT_HEAD = """
+{persona}
+
+相关文档内容：
+{{docs_text}}
+
+用户问题：{{query}}
+
+{instruction}要求：
+"""
+
+_RESPONSE_TOPICS = {
+    "张一鸣": (
+        "你是一个专业的AI助手，专门分析张一鸣的创业思考和管理理念。",
+        "请基于张一鸣的微博内容，生成一个生动、有深度的回答。",
+        [
+            "回答要体现张一鸣的个人风格和思考深度",
+            "重点突出创业思考、管理理念或技术观点",
+            "使用自然的对话语气，避免模板化表达",
+            "可以适当引用微博中的具体内容",
+        ],
+        "**避免文字过密**：确保段落之间有足够的间距，提高可读性",
+    ),
+    "字节跳动": (
+        "你是一个专业的AI助手，专门分析字节跳动的企业文化和发展历程。",
+        "请基于文档内容，生成一个专业、有深度的回答。",
+        [
+            "重点分析字节跳动的管理理念、产品思维或技术创新",
+            "回答要体现字节跳动的企业文化特点",
+            "使用专业的商业分析语言",
+            "可以结合具体案例或数据进行分析",
+        ],
+        "**避免文字过密**：确保段落之间有足够的间距，提高可读性",
+    ),
+}
+
+_DEFAULT_RESPONSE_TOPIC = (
+    "你是一个专业的AI助手，需要基于提供的文档内容来回答用户的问题。",
+    "请根据以上文档内容，生成一个专业、准确、个性化的回答。",
+    [
+        "回答要直接针对用户的问题，避免通用模板",
+        "根据查询内容调整回答风格和语气",
+        "重点突出文档中的关键信息和独特观点",
+    ],
+    "如果文档内容不足，可以适当说明但不要使用固定模板",
+)
+
+_STRUCTURE_RULES = [
+    "**采用总分结构**：先给出总体观点或结论，然后分点详细阐述",
+    "**严格使用markdown格式**：必须使用标题(#, ##, ###)、粗体(**text**)、列表(- item)等markdown元素来增强可读性",
+]
+
+_PARAGRAPH_RULE = "**确保良好的段落结构**：使用空行分隔段落，让内容层次清晰"
+
+# 流式输出逐块渲染，额外要求模型显式换行
+_STREAM_LINE_BREAK_RULES = [
+    "**确保正确的换行格式**：每个markdown元素（如标题、列表项等）后必须添加换行符，确保前端能正确解析",
+    """**强制换行规则**：
+   - 每个标题(#)后面必须紧跟一个换行符
+   - 每个列表项(-)后面必须紧跟一个换行符
+   - 每个段落结束后必须添加一个空行
+   - 粗体(**)标记不需要额外换行，但其所在的句子结束后需要换行""",
+]
+
+_FORMAT_EXAMPLE = """**格式示例**：
+   # 主标题
+   这是主标题的内容
+   
+   ## 子标题
+   这是子标题的内容
+   
+   - 列表项1
+   - 列表项2
+   
+   **重点内容**需要加粗"""
+
+_STREAM_FORMAT_EXAMPLE = """**格式示例**（严格按照此格式）：
+    # 主标题
+    
+    这是主标题下的内容段落。
+    
+    ## 子标题
+    
+    这是子标题下的内容段落。
+    
+    - 列表项一
+    
+    - 列表项二
+    
+    **重点内容**需要加粗。
+    
+    另一个段落内容。"""
+
+_RESPONSE_PROMPT_TAIL = "\n\n请严格按照以上格式生成回答：\n"
+_STREAM_RESPONSE_PROMPT_TAIL = "\n\n请严格按照以上格式生成回答，确保每个markdown元素后都有正确的换行：\n"
+
+
+def _build_response_prompt(topic, streaming: bool) -> ChatPromptTemplate:
+    persona, instruction, topic_rules, closing_rule = topic
+    if streaming:
+        rules = [
+            *topic_rules, *_STRUCTURE_RULES, *_STREAM_LINE_BREAK_RULES,
+            _PARAGRAPH_RULE, closing_rule, _STREAM_FORMAT_EXAMPLE,
+        ]
+        tail = _STREAM_RESPONSE_PROMPT_TAIL
+    else:
+        rules = [*topic_rules, *_STRUCTURE_RULES, _PARAGRAPH_RULE, closing_rule, _FORMAT_EXAMPLE]
+        tail = _RESPONSE_PROMPT_TAIL
+    head = _RESPONSE_PROMPT_HEAD.format(persona=persona, instruction=instruction)
+    body = "\n".join(f"{number}. {rule}" for number, rule in enumerate(rules, 1))
+    return ChatPromptTemplate.from_template(head + body + tail)
+
+
+# (streaming, 主题关键词) -> 解析好的提示模板；关键词为 None 表示通用模板
+_RESPONSE_PROMPTS = {
+    (streaming, keyword): _build_response_prompt(topic, streaming)
+    for streaming in (False, True)
+    for keyword, topic in chain(_RESPONSE_TOPICS.items(), [(None, _DEFAULT_RESPONSE_TOPIC)])
+}
+
+
+def _select_response_prompt(query: str, streaming: bool = False) -> ChatPromptTemplate:
+    """根据查询中出现的主题关键词选择回答提示模板"""
+
+    keyword = next((keyword for keyword in _RESPONSE_TOPICS if keyword in query), None)
+    return _RESPONSE_PROMPTS[(streaming, keyword)]
+
+
 class AgentState(TypedDict):
     query: str
     docs: List
@@ -42,15 +195,14 @@ def generate_document_summary(docs_text):
     
     # 初始化DeepSeek AI模型
     try:
-        llm = ChatOpenAI(
-            model="deepseek-chat",
-            api_key=_require_api_key(),
-            base_url=_settings.openai_api_base,
+        llm = _get_llm(
+            _require_api_key(),
+            _settings.openai_api_base,
             temperature=0.3,  # 较低温度以获得更稳定的摘要
         )
         
         # 创建摘要提示模板
-        summary_prompt = ChatPromptTemplate.from_template("""
+        summary_prompt = _get_prompt("""
 请对以下文档内容进行智能摘要：
 
 文档内容：
@@ -80,8 +232,13 @@ def generate_document_summary(docs_text):
 # AI模型智能响应生成器
 def generate_ai_response(query, docs_text):
     """使用AI模型基于文档内容生成智能响应"""
+    return _generate_ai_response(query, docs_text)[0]
+
+
+def _generate_ai_response(query, docs_text) -> Tuple[str, bool]:
+    """返回 (响应内容, 是否由模型生成)，无文档提示和本地兜底内容的标记为 False"""
     if not docs_text:
-        return "抱歉，知识库中暂无相关内容。请尝试上传相关文档或询问其他问题。"
+        return "抱歉，知识库中暂无相关内容。请尝试上传相关文档或询问其他问题。", False
     
     logger.info(
         "ai_response_start",
@@ -91,113 +248,15 @@ def generate_ai_response(query, docs_text):
     
     # 初始化DeepSeek AI模型
     try:
-        llm = ChatOpenAI(
-            model="deepseek-chat",
-            api_key=_require_api_key(),
-            base_url=_settings.openai_api_base,
+        llm = _get_llm(
+            _require_api_key(),
+            _settings.openai_api_base,
             temperature=0.8,  # 提高温度以获得更多样化的响应
         )
         
-        # 根据查询类型定制化提示模板
-        if "张一鸣" in query:
-            prompt_template = """
-你是一个专业的AI助手，专门分析张一鸣的创业思考和管理理念。
-
-用户问题：{query}
-
-相关文档内容：
-{docs_text}
-
-请基于张一鸣的微博内容，生成一个生动、有深度的回答。要求：
-1. 回答要体现张一鸣的个人风格和思考深度
-2. 重点突出创业思考、管理理念或技术观点
-3. 使用自然的对话语气，避免模板化表达
-4. 可以适当引用微博中的具体内容
-5. **采用总分结构**：先给出总体观点或结论，然后分点详细阐述
-6. **严格使用markdown格式**：必须使用标题(#, ##, ###)、粗体(**text**)、列表(- item)等markdown元素来增强可读性
-7. **确保良好的段落结构**：使用空行分隔段落，让内容层次清晰
-8. **避免文字过密**：确保段落之间有足够的间距，提高可读性
-9. **格式示例**：
-   # 主标题
-   这是主标题的内容
-   
-   ## 子标题
-   这是子标题的内容
-   
-   - 列表项1
-   - 列表项2
-   
-   **重点内容**需要加粗
-
-请严格按照以上格式生成回答：
-"""
-        elif "字节跳动" in query:
-            prompt_template = """
-你是一个专业的AI助手，专门分析字节跳动的企业文化和发展历程。
-
-用户问题：{query}
-
-相关文档内容：
-{docs_text}
-
-请基于文档内容，生成一个专业、有深度的回答。要求：
-1. 重点分析字节跳动的管理理念、产品思维或技术创新
-2. 回答要体现字节跳动的企业文化特点
-3. 使用专业的商业分析语言
-4. 可以结合具体案例或数据进行分析
-5. **采用总分结构**：先给出总体观点或结论，然后分点详细阐述
-6. **严格使用markdown格式**：必须使用标题(#, ##, ###)、粗体(**text**)、列表(- item)等markdown元素来增强可读性
-7. **确保良好的段落结构**：使用空行分隔段落，让内容层次清晰
-8. **避免文字过密**：确保段落之间有足够的间距，提高可读性
-9. **格式示例**：
-   # 主标题
-   这是主标题的内容
-   
-   ## 子标题
-   这是子标题的内容
-   
-   - 列表项1
-   - 列表项2
-   
-   **重点内容**需要加粗
-
-请严格按照以上格式生成回答：
-"""
-        else:
-            prompt_template = """
-你是一个专业的AI助手，需要基于提供的文档内容来回答用户的问题。
-
-用户问题：{query}
-
-相关文档内容：
-{docs_text}
-
-请根据以上文档内容，生成一个专业、准确、个性化的回答。要求：
-1. 回答要直接针对用户的问题，避免通用模板
-2. 根据查询内容调整回答风格和语气
-3. 重点突出文档中的关键信息和独特观点
-4. **采用总分结构**：先给出总体观点或结论，然后分点详细阐述
-5. **严格使用markdown格式**：必须使用标题(#, ##, ###)、粗体(**text**)、列表(- item)等markdown元素来增强可读性
-6. **确保良好的段落结构**：使用空行分隔段落，让内容层次清晰
-7. 如果文档内容不足，可以适当说明但不要使用固定模板
-8. **格式示例**：
-   # 主标题
-   这是主标题的内容
-   
-   ## 子标题
-   这是子标题的内容
-   
-   - 列表项1
-   - 列表项2
-   
-   **重点内容**需要加粗
-
-请严格按照以上格式生成回答：
-"""
-        
-        prompt = ChatPromptTemplate.from_template(prompt_template)
-        chain = prompt | llm
-        response = chain.invoke({"query": query, "docs_text": docs_text})
+        # 根据查询主题选择预先解析好的提示模板
+        prompt = _select_response_prompt(query)
+        response = (prompt | llm).invoke({"query": query, "docs_text": docs_text})
 
         response_content = response.content
         logger.info(
@@ -207,15 +266,19 @@ def generate_ai_response(query, docs_text):
             paragraph_breaks=response_content.count("\n\n"),
         )
 
-        return response_content
+        return response_content, True
 
     except Exception as exc:
         logger.exception("ai_response_failed", error=str(exc))
-        return generate_local_response(query, docs_text)
+        return generate_local_response(query, docs_text), False
 
 # 流式AI模型智能响应生成器
-async def generate_ai_response_stream(query, docs_text):
-    """使用AI模型基于文档内容生成流式智能响应"""
+async def generate_ai_response_stream(query, docs_text, outcome=None):
+    """使用AI模型基于文档内容生成流式智能响应
+
+    调用方可传入字典 ``outcome``：仅当模型完整生成回答时写入 ``outcome["from_llm"] = True``，
+    无文档提示或调用失败后输出的本地兜底内容不会设置该标记。
+    """
     if not docs_text:
         yield "抱歉，知识库中暂无相关内容。请尝试上传相关文档或询问其他问题。"
         return
@@ -228,171 +291,36 @@ async def generate_ai_response_stream(query, docs_text):
     
     # 初始化DeepSeek AI模型（支持流式）
     try:
-        llm = ChatOpenAI(
-            model="deepseek-chat",
-            api_key=_require_api_key(),
-            base_url=_settings.openai_api_base,
+        llm = _get_llm(
+            _require_api_key(),
+            _settings.openai_api_base,
             temperature=0.8,  # 提高温度以获得更多样化的响应
             streaming=True,  # 启用流式输出
         )
         
-        # 根据查询类型定制化提示模板
-        if "张一鸣" in query:
-            prompt_template = """
-你是一个专业的AI助手，专门分析张一鸣的创业思考和管理理念。
-
-用户问题：{query}
-
-相关文档内容：
-{docs_text}
-
-请基于张一鸣的微博内容，生成一个生动、有深度的回答。要求：
-1. 回答要体现张一鸣的个人风格和思考深度
-2. 重点突出创业思考、管理理念或技术观点
-3. 使用自然的对话语气，避免模板化表达
-4. 可以适当引用微博中的具体内容
-5. **采用总分结构**：先给出总体观点或结论，然后分点详细阐述
-6. **严格使用markdown格式**：必须使用标题(#, ##, ###)、粗体(**text**)、列表(- item)等markdown元素来增强可读性
-7. **确保正确的换行格式**：每个markdown元素（如标题、列表项等）后必须添加换行符，确保前端能正确解析
-8. **强制换行规则**：
-   - 每个标题(#)后面必须紧跟一个换行符
-   - 每个列表项(-)后面必须紧跟一个换行符
-   - 每个段落结束后必须添加一个空行
-   - 粗体(**)标记不需要额外换行，但其所在的句子结束后需要换行
-9. **确保良好的段落结构**：使用空行分隔段落，让内容层次清晰
-10. **避免文字过密**：确保段落之间有足够的间距，提高可读性
-11. **格式示例**（严格按照此格式）：
-    # 主标题
-    
-    这是主标题下的内容段落。
-    
-    ## 子标题
-    
-    这是子标题下的内容段落。
-    
-    - 列表项一
-    
-    - 列表项二
-    
-    **重点内容**需要加粗。
-    
-    另一个段落内容。
-
-请严格按照以上格式生成回答，确保每个markdown元素后都有正确的换行：
-"""
-        elif "字节跳动" in query:
-            prompt_template = """
-你是一个专业的AI助手，专门分析字节跳动的企业文化和发展历程。
-
-用户问题：{query}
-
-相关文档内容：
-{docs_text}
-
-请基于文档内容，生成一个专业、有深度的回答。要求：
-1. 重点分析字节跳动的管理理念、产品思维或技术创新
-2. 回答要体现字节跳动的企业文化特点
-3. 使用专业的商业分析语言
-4. 可以结合具体案例或数据进行分析
-5. **采用总分结构**：先给出总体观点或结论，然后分点详细阐述
-6. **严格使用markdown格式**：必须使用标题(#, ##, ###)、粗体(**text**)、列表(- item)等markdown元素来增强可读性
-7. **确保正确的换行格式**：每个markdown元素（如标题、列表项等）后必须添加换行符，确保前端能正确解析
-8. **强制换行规则**：
-   - 每个标题(#)后面必须紧跟一个换行符
-   - 每个列表项(-)后面必须紧跟一个换行符
-   - 每个段落结束后必须添加一个空行
-   - 粗体(**)标记不需要额外换行，但其所在的句子结束后需要换行
-9. **确保良好的段落结构**：使用空行分隔段落，让内容层次清晰
-10. **避免文字过密**：确保段落之间有足够的间距，提高可读性
-11. **格式示例**（严格按照此格式）：
-    # 主标题
-    
-    这是主标题下的内容段落。
-    
-    ## 子标题
-    
-    这是子标题下的内容段落。
-    
-    - 列表项一
-    
-    - 列表项二
-    
-    **重点内容**需要加粗。
-    
-    另一个段落内容。
-
-请严格按照以上格式生成回答，确保每个markdown元素后都有正确的换行：
-"""
-        else:
-            prompt_template = """
-你是一个专业的AI助手，需要基于提供的文档内容来回答用户的问题。
-
-用户问题：{query}
-
-相关文档内容：
-{docs_text}
-
-请根据以上文档内容，生成一个专业、准确、个性化的回答。要求：
-1. 回答要直接针对用户的问题，避免通用模板
-2. 根据查询内容调整回答风格和语气
-3. 重点突出文档中的关键信息和独特观点
-4. **采用总分结构**：先给出总体观点或结论，然后分点详细阐述
-5. **严格使用markdown格式**：必须使用标题(#, ##, ###)、粗体(**text**)、列表(- item)等markdown元素来增强可读性
-6. **确保正确的换行格式**：每个markdown元素（如标题、列表项等）后必须添加换行符，确保前端能正确解析
-7. **强制换行规则**：
-   - 每个标题(#)后面必须紧跟一个换行符
-   - 每个列表项(-)后面必须紧跟一个换行符
-   - 每个段落结束后必须添加一个空行
-   - 粗体(**)标记不需要额外换行，但其所在的句子结束后需要换行
-8. **确保良好的段落结构**：使用空行分隔段落，让内容层次清晰
-9. 如果文档内容不足，可以适当说明但不要使用固定模板
-10. **格式示例**（严格按照此格式）：
-    # 主标题
-    
-    这是主标题下的内容段落。
-    
-    ## 子标题
-    
-    这是子标题下的内容段落。
-    
-    - 列表项一
-    
-    - 列表项二
-    
-    **重点内容**需要加粗。
-    
-    另一个段落内容。
-
-请严格按照以上格式生成回答，确保每个markdown元素后都有正确的换行：
-"""
-        
-        # 生成流式AI响应
-        prompt = ChatPromptTemplate.from_template(prompt_template)
-        chain = prompt | llm
-        response_stream = chain.astream({"query": query, "docs_text": docs_text})
+        # 根据查询主题选择预先解析好的提示模板
+        prompt = _select_response_prompt(query, streaming=True)
+        response_stream = (prompt | llm).astream({"query": query, "docs_text": docs_text})
         
         # 流式输出响应内容，逐字显示（蹦字效果）
-        full_response = ""
+        parts = []
         chunk_count = 0
         
         async for chunk in response_stream:
             if hasattr(chunk, 'content'):
-                full_response += chunk.content
+                parts.append(chunk.content)
                 chunk_count += 1
                 
                 # 直接输出每个字符，实现蹦字效果
                 if chunk.content:
                     yield chunk.content
                 
-                if chunk_count % 50 == 0:  # 每50个chunk打印一次进度
-                    logger.info(
-                        "stream_response_progress",
-                        chunks=chunk_count,
-                        response_length=len(full_response),
-                    )
+                if chunk_count % 50 == 0:  # 每50个chunk记录一次进度（仅 DEBUG 级别输出）
+                    logger.debug("stream_response_progress", chunks=chunk_count)
         
         # 蹦字效果不需要处理剩余chunk，因为每个字符都已经直接输出了
         
+        full_response = "".join(parts)
         logger.info(
             "stream_response_complete",
             chunks=chunk_count,
@@ -400,6 +328,8 @@ async def generate_ai_response_stream(query, docs_text):
             newline_count=full_response.count(chr(10)),
             paragraph_breaks=full_response.count("\n\n"),
         )
+        if outcome is not None:
+            outcome["from_llm"] = True
         
     except Exception as exc:
         # 如果AI模型调用失败，回退到本地响应生成器
@@ -416,17 +346,84 @@ def generate_local_response(query, docs_text):
     if not docs_text:
         return "抱歉，知识库中暂无相关内容。请尝试上传相关文档或询问其他问题。"
     
-    # 将文档内容分割成句子
-    lines = docs_text.split('\n')
-    
-    # 提取有意义的句子
-    meaningful_lines = [s for s in lines if len(s.strip()) > 20]
+    # 将文档内容分割成句子，只取前8个有意义的句子，凑够即停止扫描
+    meaningful_lines = list(islice((s for s in docs_text.split('\n') if len(s.strip()) > 20), 8))
     
     if meaningful_lines:
-        return f"根据文档内容，与您的问题相关的信息如下：\n\n{chr(10).join(meaningful_lines[:8])}\n\n如需更详细信息，请参考上传的文档。"
+        return f"根据文档内容，与您的问题相关的信息如下：\n\n{chr(10).join(meaningful_lines)}\n\n如需更详细信息，请参考上传的文档。"
     else:
         return f"根据文档内容，相关信息如下：\n\n{docs_text}\n\n如需更详细信息，请参考上传的文档。"
 
+# 响应缓存：按规范化后的问题与检索内容摘要精确匹配，相同问题在相同文档下直接复用已生成的回答
+_RESPONSE_CACHE_SIZE = 512
+_response_cache: "OrderedDict[str, str]" = OrderedDict()
+_RESPONSE_CACHE_LOCK = Lock()
+
+
+def _response_cache_key(query, docs_text):
+    """问题只做空白与大小写规范化，措辞不同的问题各自生成回答"""
+    normalized = " ".join(query.split()).casefold()
+    return hashlib.blake2b(f"{normalized}\0{docs_text}".encode("utf-8"), digest_size=16).hexdigest()
+
+
+def generate_cached_ai_response(query, docs_text):
+    """先查响应缓存，未命中时再调用AI模型生成响应"""
+    if not docs_text:
+        return generate_ai_response(query, docs_text)
+    
+    cache_key = _response_cache_key(query, docs_text)
+    with _RESPONSE_CACHE_LOCK:
+        cached = _response_cache.get(cache_key)
+        if cached is not None:
+            _response_cache.move_to_end(cache_key)
+    if cached is not None:
+        logger.info("ai_response_cache_hit", query=query)
+        return cached
+    
+    response, from_llm = _generate_ai_response(query, docs_text)
+    # 模型调用失败时返回的是本地兜底回答，不写入缓存
+    if from_llm:
+        with _RESPONSE_CACHE_LOCK:
+            _response_cache[cache_key] = response
+            _response_cache.move_to_end(cache_key)
+            while len(_response_cache) > _RESPONSE_CACHE_SIZE:
+                _response_cache.popitem(last=False)
+    return response
+
+# 送入模型的文档内容总长度上限（字符数）
+_MAX_DOCS_CHARS = 8000
+
+def select_prompt_docs(docs, max_chars=_MAX_DOCS_CHARS):
+    """按检索排名去掉内容重复的文档块，并在总长度超过上限时截止
+
+    至少保留排名第一的文档块。
+    """
+    seen = set()
+    selected = []
+    total = 0
+    for doc in docs:
+        content = doc.page_content
+        if content in seen:
+            continue
+        if selected and total + len(content) > max_chars:
+            break
+        seen.add(content)
+        selected.append(doc)
+        total += len(content)
+    return selected
+
+def _join_docs(docs):
+    """去重截断后按来源、页码、块号稳定排序拼接文档
+
+    文档块排在提示词中问题之前，相同的检索结果集合会得到字节一致的前缀，
+    便于模型服务端的前缀缓存命中。
+    """
+    ordered = sorted(
+        select_prompt_docs(docs),
+        key=lambda d: (str(d.metadata.get("source", "")), d.metadata.get("page", 0), d.metadata.get("chunk", 0)),
+    )
+    return "\n".join(d.page_content for d in ordered)
+
 def retrieve_node(state):
     retriever = get_hybrid_rerank_retriever()
     query = state["query"]
@@ -441,9 +438,8 @@ def reflect_node(state):
     return {"reflection": "基于文档内容进行回答。"}
 
 def response_node(state):
-    # 使用所有检索到的文档内容，不做限制
-    docs_text = "\n".join([d.page_content for d in state["docs"]])
-    response = generate_ai_response(state["query"], docs_text)
+    docs_text = _join_docs(state["docs"])
+    response = generate_cached_ai_response(state["query"], docs_text)
     return {"response": response}
 
 def create_workflow():
@@ -452,10 +448,13 @@ def create_workflow():
     g.add_node("summarize", summarize_node)
     g.add_node("reflect", reflect_node)
     g.add_node("response", response_node)
+    # 摘要和反思只依赖检索结果，与生成响应并行执行，不占用关键路径
     g.add_edge("retrieve", "summarize")
-    g.add_edge("summarize", "reflect")
-    g.add_edge("reflect", "response")
+    g.add_edge("retrieve", "reflect")
+    g.add_edge("retrieve", "response")
     g.set_entry_point("retrieve")
+    g.add_edge("summarize", END)
+    g.add_edge("reflect", END)
     g.set_finish_point("response")
     return g.compile()
 
@@ -467,10 +466,9 @@ def create_simple_workflow():
         """直接生成响应，使用AI模型"""
         retriever = get_hybrid_rerank_retriever()
         docs = retriever.invoke(state["query"])
-        # 使用所有检索到的文档内容，不做限制
-        docs_text = "\n".join([d.page_content for d in docs]) if docs else ""
+        docs_text = _join_docs(docs) if docs else ""
         
-        response = generate_ai_response(state["query"], docs_text)
+        response = generate_cached_ai_response(state["query"], docs_text)
         return {"response": response}
     
     g.add_node("simple_response", simple_response_node)
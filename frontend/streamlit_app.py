@@ -1,13 +1,16 @@
-import base64
+import heapq
 import json
 import os
-import pickle
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from itertools import islice
 from urllib.parse import quote_plus
 
+import orjson
 import requests
 import streamlit as st
+from requests.adapters import HTTPAdapter
 
 API_URL = "http://localhost:8000/chat"
 STREAM_API_URL = "http://localhost:8000/chat_stream"
@@ -27,6 +30,31 @@ WECHAT_CALLBACK_API = f"{AUTH_BASE_URL}/wechat/callback"
 QR_CODE_TEMPLATE = "https://api.qrserver.com/v1/create-qr-code/?size=240x240&data={data}"
 PROVIDER_LABELS = {"google": "Google", "wechat": "微信"}
 
+
+@st.cache_resource
+def get_http_session():
+    """所有后端请求共用一个带连接池的会话，避免每次请求重新建立连接"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+@st.cache_resource
+def get_request_executor():
+    """后台线程池，用于在渲染页面的同时预先发起后端请求"""
+    return ThreadPoolExecutor(max_workers=4)
+
+
+# 流式输出时限制重新渲染 markdown 的频率，避免每个分片都重新解析整段文本
+STREAM_RENDER_INTERVAL = 0.04
+STREAM_RENDER_MIN_CHARS = 64
+
+SSE_FRAME_SEPARATOR = b"\n\n"
+SSE_DATA_FIELD = b"data:"
+SSE_DONE_MARKER = b"[DONE]"
+
 st.set_page_config(page_title="DocChat AI - 与文档聊天对话，获得更深的洞见", page_icon="📚", layout="wide")
 
 # 添加基本的CSS样式确保文本换行
@@ -45,37 +73,98 @@ st.markdown(
 
 st.title("📚 DocChat AI - 与文档聊天对话，获得更深的洞见")
 
-HISTORY_FILE = "data/chat_history.pkl"
+HISTORY_FILE = "data/chat_history.jsonl"
+HISTORY_PAGE_SIZE = 50
 
 
 # ================= 持久化工具函数 =================
 
 def save_history_to_storage(history):
-    """保存对话历史到持久化存储"""
+    """保存对话历史到持久化存储（只追加尚未写入的消息）"""
     try:
         os.makedirs("data", exist_ok=True)
-        with open(HISTORY_FILE, "wb") as f:
-            pickle.dump(history, f)
+        persisted_len = st.session_state.get("history_persisted_len", 0)
+        if not history or len(history) < persisted_len:
+            # 历史被清空或截断时写入临时文件后原子替换，避免中途崩溃留下半个文件
+            tmp_path = f"{HISTORY_FILE}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.writelines(orjson.dumps(msg) + b"\n" for msg in history)
+            os.replace(tmp_path, HISTORY_FILE)
+        else:
+            with open(HISTORY_FILE, "ab") as f:
+                f.writelines(orjson.dumps(msg) + b"\n" for msg in history[persisted_len:])
         st.session_state["history"] = history
+        st.session_state["history_persisted_len"] = len(history)
     except Exception as e:
         st.error(f"保存对话历史失败: {str(e)}")
 
 
 def load_history_from_storage():
     """从持久化存储加载对话历史"""
+    history = []
     try:
         if os.path.exists(HISTORY_FILE):
             with open(HISTORY_FILE, "rb") as f:
-                return pickle.load(f)
+                for line in f:
+                    try:
+                        history.append(orjson.loads(line))
+                    except orjson.JSONDecodeError:
+                        # 跳过写入中断留下的残缺行
+                        continue
     except Exception:
         pass
-    return []
+    st.session_state["history_persisted_len"] = len(history)
+    return history
+
+
+def show_more_history():
+    """在对话区多显示一页更早的消息"""
+    st.session_state["history_visible"] = st.session_state.get("history_visible", HISTORY_PAGE_SIZE) + HISTORY_PAGE_SIZE
+
+
+# ================= 知识库文档列表 =================
+
+# TTL 内的重渲染完全不发请求；过期后用 ETag 重新验证，列表未变时只多一次 304
+DOCUMENT_LIST_TTL = 30.0
+
+
+def fetch_document_list(session, previous=None):
+    """请求知识库文档列表，在线程池中执行，不调用任何 Streamlit 接口
+
+    携带上一次的 ETag 发起条件请求，列表未变化时后端只返回 304，直接复用旧结果。
+    返回 (etag, documents)，请求失败时返回 None。
+    """
+    headers = {"If-None-Match": previous[0]} if previous and previous[0] else None
+    response = session.get(LIST_DOCS_URL, headers=headers, timeout=10)
+    if response.status_code == 304 and previous:
+        return previous
+    if response.status_code != 200:
+        return None
+    return response.headers.get("ETag"), response.json().get("documents", [])
+
+
+def prefetch_document_list():
+    """后台发起文档列表请求；短时间内的重复渲染直接复用上一次结果"""
+    cached = st.session_state.get("document_list")
+    if cached and cached[0] > time.monotonic():
+        return
+    previous = None
+    if cached and cached[1].done() and cached[1].exception() is None:
+        previous = cached[1].result()
+    future = get_request_executor().submit(fetch_document_list, get_http_session(), previous)
+    st.session_state["document_list"] = (time.monotonic() + DOCUMENT_LIST_TTL, future)
+
+
+def invalidate_document_list():
+    st.session_state.pop("document_list", None)
 
 
 # ================= 登录辅助函数 =================
 
 def _init_session_defaults():
     st.session_state.setdefault("oauth_pending_states", {})
+    # (过期时间, state) 小顶堆，清理时只需查看堆顶
+    st.session_state.setdefault("oauth_expiry_heap", [])
     st.session_state.setdefault("wechat_login", None)
 
 
@@ -83,18 +172,26 @@ def remember_pending_state(state: str | None, provider: str, expires_in: int | f
     if not state:
         return
     pending = st.session_state.setdefault("oauth_pending_states", {})
+    expires_at = time.time() + max(float(expires_in), 1.0)
     pending[state] = {
         "provider": provider,
-        "expires_at": time.time() + max(float(expires_in), 1.0),
+        "expires_at": expires_at,
     }
+    heapq.heappush(st.session_state.setdefault("oauth_expiry_heap", []), (expires_at, state))
 
 
 def cleanup_expired_oauth_states() -> None:
+    heap = st.session_state.get("oauth_expiry_heap")
+    if not heap:
+        return
     pending = st.session_state.get("oauth_pending_states", {})
     now = time.time()
-    expired_tokens = [token for token, meta in pending.items() if meta.get("expires_at", 0) <= now]
-    for token in expired_tokens:
-        pending.pop(token, None)
+    while heap and heap[0][0] <= now:
+        _, token = heapq.heappop(heap)
+        # 已完成回调的 state 不在 pending 中；同一 state 重新登记后以最新的过期时间为准
+        meta = pending.get(token)
+        if meta is not None and meta.get("expires_at", 0) <= now:
+            del pending[token]
 
 
 def trigger_external_redirect(url: str | None) -> None:
@@ -107,7 +204,7 @@ def trigger_external_redirect(url: str | None) -> None:
 
 def start_google_login() -> None:
     try:
-        response = requests.get(GOOGLE_LOGIN_API, timeout=10)
+        response = get_http_session().get(GOOGLE_LOGIN_API, timeout=10)
         response.raise_for_status()
         data = response.json()
     except requests.RequestException as exc:
@@ -125,7 +222,7 @@ def ensure_wechat_login() -> dict | None:
         return login_info
 
     try:
-        response = requests.get(WECHAT_QRCODE_API, timeout=10)
+        response = get_http_session().get(WECHAT_QRCODE_API, timeout=10)
         response.raise_for_status()
         data = response.json()
     except requests.RequestException as exc:
@@ -155,8 +252,13 @@ def _guess_provider_from_params(params: dict[str, list[str]]) -> str | None:
 
 def handle_oauth_callback() -> None:
     params = st.query_params
-    code = params.get("code", [None])[0]
-    state = params.get("state", [None])[0]
+    # 绝大多数重新运行都不是 OAuth 回调，只做成员检查后直接返回
+    if "code" not in params or "state" not in params:
+        return
+
+    # st.query_params.get 返回字符串本身，而不是值列表
+    code = params.get("code")
+    state = params.get("state")
 
     if not code or not state:
         return
@@ -172,7 +274,7 @@ def handle_oauth_callback() -> None:
 
     callback_api = GOOGLE_CALLBACK_API if provider == "google" else WECHAT_CALLBACK_API
     try:
-        response = requests.get(callback_api, params={"code": code, "state": state}, timeout=10)
+        response = get_http_session().get(callback_api, params={"code": code, "state": state}, timeout=10)
         response.raise_for_status()
         payload = response.json()
     except requests.HTTPError as exc:
@@ -206,6 +308,7 @@ def handle_oauth_callback() -> None:
 def logout_user() -> None:
     st.session_state.pop("auth_user", None)
     st.session_state["oauth_pending_states"] = {}
+    st.session_state["oauth_expiry_heap"] = []
     st.session_state["wechat_login"] = None
     save_history_to_storage([])
 
@@ -274,6 +377,101 @@ def render_login_section() -> bool:
     return False
 
 
+def report_clear_history_result():
+    """后台清理对话历史的请求完成后，提示一次失败原因；成功时不再打扰"""
+    future = st.session_state.get("clear_history_request")
+    if future is None or not future.done():
+        return
+    st.session_state.pop("clear_history_request")
+    try:
+        response = future.result()
+    except requests.RequestException as exc:
+        st.error(f"调用API失败: {exc}")
+    else:
+        if response.status_code != 200:
+            st.error("清理对话历史失败")
+
+
+# ================= 侧边栏片段 =================
+
+def delete_document(filename):
+    """删除按钮回调：在片段重新运行前执行删除，结果留给列表渲染时展示"""
+    try:
+        response = get_http_session().post(f"{DELETE_DOC_URL}/{filename}", timeout=10)
+        if response.status_code == 200:
+            result = response.json()
+            feedback = ("success", f"{result['status']}: {result['message']}")
+        else:
+            feedback = ("error", f"删除失败: {response.status_code}")
+    except Exception as exc:
+        feedback = ("error", f"删除文档时发生错误: {exc}")
+    st.session_state["document_feedback"] = feedback
+    invalidate_document_list()
+
+
+@st.fragment
+def render_document_list():
+    """文档列表作为局部片段：删除文档只刷新列表本身，不重绘整个页面"""
+    st.header("📚 知识库文档")
+
+    feedback = st.session_state.pop("document_feedback", None)
+    if feedback:
+        level, message = feedback
+        if level == "success":
+            st.success(message)
+        else:
+            st.error(message)
+
+    try:
+        prefetch_document_list()
+        listing = st.session_state["document_list"][1].result()
+        documents = listing[1] if listing is not None else None
+        if documents is not None:
+            if documents:
+                st.write(f"📄 当前知识库中有 {len(documents)} 个文档：")
+
+                for doc in documents:
+                    col1, col2 = st.columns([3, 1])
+                    with col1:
+                        st.write(f"• {doc['filename']} ({doc['size_mb']} MB)")
+                    with col2:
+                        st.button(
+                            "🗑️",
+                            key=f"delete_{doc['filename']}",
+                            help=f"删除 {doc['filename']}",
+                            on_click=delete_document,
+                            args=(doc["filename"],),
+                        )
+            else:
+                st.info("📭 知识库为空，请上传PDF文档")
+        else:
+            invalidate_document_list()
+            st.error("获取文档列表失败")
+    except Exception as exc:
+        invalidate_document_list()
+        st.error(f"获取文档列表时发生错误: {exc}")
+
+
+@st.fragment
+def render_upload_section():
+    """上传区域作为局部片段：选择文件只重新运行本片段，不重绘整个对话历史"""
+    st.header("📂 上传PDF文档")
+    files = st.file_uploader("上传文件", type=["pdf"], accept_multiple_files=True)
+    if st.button("📘 构建知识库") and files:
+        # 以 multipart 方式直接上传原始文件，无需 base64 编码
+        payload = [("files", (file.name, file, "application/pdf")) for file in files]
+        try:
+            resp = get_http_session().post(UPLOAD_URL, files=payload, timeout=30)
+        except requests.RequestException as exc:
+            st.error(f"上传失败：{exc}")
+        else:
+            if resp.status_code == 200:
+                st.success(resp.json().get("status", "知识库已更新"))
+                invalidate_document_list()
+            else:
+                st.error(f"上传失败: {resp.status_code}")
+
+
 # ================= 页面初始化流程 =================
 
 _init_session_defaults()
@@ -302,6 +500,7 @@ if feedback:
 if "history" not in st.session_state:
     st.session_state["history"] = load_history_from_storage()
 
+prefetch_document_list()
 authenticated = render_login_section()
 
 if not authenticated:
@@ -309,68 +508,11 @@ if not authenticated:
 
 # ================= 侧边栏：知识库与清理操作 =================
 with st.sidebar:
-    st.header("📚 知识库文档")
-
-    try:
-        response = requests.get(LIST_DOCS_URL, timeout=10)
-        if response.status_code == 200:
-            data = response.json()
-            documents = data.get("documents", [])
-
-            if documents:
-                st.write(f"📄 当前知识库中有 {len(documents)} 个文档：")
-
-                for doc in documents:
-                    col1, col2 = st.columns([3, 1])
-                    with col1:
-                        st.write(f"• {doc['filename']} ({doc['size_mb']} MB)")
-                    with col2:
-                        if st.button("🗑️", key=f"delete_{doc['filename']}", help=f"删除 {doc['filename']}"):
-                            try:
-                                delete_response = requests.post(
-                                    f"{DELETE_DOC_URL}/{doc['filename']}", timeout=10
-                                )
-                                if delete_response.status_code == 200:
-                                    result = delete_response.json()
-                                    st.success(f"{result['status']}: {result['message']}")
-                                    st.rerun()
-                                else:
-                                    st.error(f"删除失败: {delete_response.status_code}")
-                            except Exception as exc:
-                                st.error(f"删除文档时发生错误: {exc}")
-            else:
-                st.info("📭 知识库为空，请上传PDF文档")
-        else:
-            st.error("获取文档列表失败")
-    except Exception as exc:
-        st.error(f"获取文档列表时发生错误: {exc}")
+    render_document_list()
 
     st.divider()
 
-    st.header("📂 上传PDF文档")
-    files = st.file_uploader("上传文件", type=["pdf"], accept_multiple_files=True)
-    if st.button("📘 构建知识库") and files:
-        payload = []
-        for file in files:
-            try:
-                encoded = base64.b64encode(file.read()).decode("utf-8")
-                payload.append({"filename": file.name, "content": encoded})
-            except Exception as exc:
-                st.error(f"文件 {file.name} 编码失败: {exc}")
-                continue
-
-        if payload:
-            try:
-                resp = requests.post(UPLOAD_URL, json=payload, timeout=30)
-            except requests.RequestException as exc:
-                st.error(f"上传失败：{exc}")
-            else:
-                if resp.status_code == 200:
-                    st.success(resp.json().get("status", "知识库已更新"))
-                else:
-                    st.error(f"上传失败: {resp.status_code}")
-        else:
-            st.error("没有有效的文件可以上传")
+    render_upload_section()
 
     st.divider()
 
@@ -379,32 +521,30 @@ with st.sidebar:
     with col1:
         if st.button("🧹 清空记忆"):
             try:
-                requests.post(RESET_URL, timeout=10)
+                get_http_session().post(RESET_URL, timeout=10)
                 st.success("记忆已清空")
             except requests.RequestException as exc:
                 st.error(f"清空记忆失败：{exc}")
     with col2:
         if st.button("🗑️ 清理对话历史"):
-            try:
-                response = requests.post(CLEAR_HISTORY_URL, timeout=10)
-                if response.status_code == 200:
-                    st.success("对话历史已清理")
-                else:
-                    st.error("清理对话历史失败")
-            except requests.RequestException as exc:
-                st.error(f"调用API失败: {exc}")
+            # 本地历史立即清空并刷新页面，后端清理在后台线程中完成，结果在之后的渲染中提示
+            st.session_state["clear_history_request"] = get_request_executor().submit(
+                get_http_session().post, CLEAR_HISTORY_URL, timeout=10
+            )
             save_history_to_storage([])
             st.rerun()
+        report_clear_history_result()
 
     st.divider()
 
     st.subheader("🗑️ 知识库管理")
     if st.button("🗂️ 清理知识库", type="secondary", help="删除所有上传的PDF文档和向量数据库"):
         try:
-            response = requests.post(CLEAR_KB_URL, timeout=30)
+            response = get_http_session().post(CLEAR_KB_URL, timeout=30)
             if response.status_code == 200:
                 result = response.json()
                 st.success(f"{result['status']}: {result['message']}")
+                invalidate_document_list()
                 st.rerun()
             else:
                 st.error(f"清理失败: {response.status_code}")
@@ -415,91 +555,93 @@ with st.sidebar:
 st.subheader("💬 对话区")
 query = st.chat_input("请输入问题...")
 
-for msg in st.session_state["history"]:
-    if msg["role"] == "user":
-        with st.chat_message("user"):
-            st.markdown(msg["content"])
-    else:
-        with st.chat_message("assistant"):
-            st.markdown(msg["content"])
+history = st.session_state["history"]
+hidden_count = max(len(history) - st.session_state.setdefault("history_visible", HISTORY_PAGE_SIZE), 0)
+if hidden_count:
+    st.button(f"⬆️ 加载更早的消息（还有 {hidden_count} 条）", on_click=show_more_history)
 
+# 只渲染最近的若干条消息，历史再长每次重新运行的渲染量也保持不变
+for msg in islice(history, hidden_count, None):
+    st.chat_message("user" if msg["role"] == "user" else "assistant").markdown(msg["content"])
 
-def process_sse_stream(buffer, data_buffer=""):
+
+def process_sse_stream(chunk, data_buffer):
     """
-    处理实时生成的 SSE 流式数据，确保有效数据不丢失，并保留换行符。
-    :param buffer: 当前实时接收的数据片段
-    :param data_buffer: 之前接收到的数据缓冲区，初始为空
-    :return: 返回有效的解析数据列表，并更新data_buffer为剩余部分
+    按 SSE 帧分隔符（空行）解析实时接收的字节流，保留换行符。
+    每帧内的多行 data 按规范用换行符拼回，得到服务端发送的原始片段。
+    :param chunk: 当前实时接收的字节片段
+    :param data_buffer: 尚未构成完整帧的剩余字节（bytearray，原地更新）
+    :return: 返回有效的解析数据列表，以及是否收到结束标记
     """
-    data_buffer += buffer
-    result = []
-    is_done = False
-
-    while True:
-        start_index = data_buffer.find("data: ")
-        end_index = data_buffer.find("data: DONE")
-
-        if start_index == -1:
-            break
-
-        start_index += len("data: ")
-
-        if end_index == -1:
-            end_index = len(data_buffer) - 2
-
-        valid_data = data_buffer[start_index:end_index]
-
-        if valid_data:
-            result.append(valid_data)
+    data_buffer += chunk
+    end = data_buffer.rfind(SSE_FRAME_SEPARATOR)
+    if end == -1:
+        return [], False
 
-        data_buffer = data_buffer[end_index + 2 + len("data: DONE"):]
-
-        if "data: DONE" in data_buffer:
-            is_done = True
-            break
-
-    return result, data_buffer, is_done
+    frames = bytes(data_buffer[:end]).split(SSE_FRAME_SEPARATOR)
+    del data_buffer[:end + len(SSE_FRAME_SEPARATOR)]
 
+    result = []
+    for frame in frames:
+        lines = [
+            line[len(SSE_DATA_FIELD):].removeprefix(b" ")
+            for line in frame.split(b"\n")
+            if line.startswith(SSE_DATA_FIELD)
+        ]
+        if not lines:
+            continue
+        payload = b"\n".join(lines)
+        if payload == SSE_DONE_MARKER:
+            return result, True
+        result.append(payload.decode("utf-8"))
+
+    return result, False
 
 if query:
     with st.chat_message("user"):
         st.markdown(query)
 
+    # 用户消息与回答在本轮结束时一起写入；若本轮被中断，下次保存会补写未落盘的消息
     st.session_state["history"].append({"role": "user", "content": query})
-    save_history_to_storage(st.session_state["history"])
 
     full_response = ""
     try:
-        response = requests.post(STREAM_API_URL, json={"query": query}, stream=True, timeout=30)
-
-        if response.status_code == 200:
-            with st.chat_message("assistant"):
-                markdown_placeholder = st.empty()
-
-                markdown_buffer = ""
-                buffer = ""
-                data_buffer = ""
-                for chunk in response.iter_content(chunk_size=1024):
-                    if not chunk:
-                        continue
-
-                    try:
-                        buffer = chunk.decode("utf-8")
-                    except UnicodeDecodeError:
-                        buffer = chunk.decode("utf-8", errors="ignore")
-
-                    results, data_buffer, is_done = process_sse_stream(buffer, data_buffer)
-
-                    markdown_buffer = "".join(results)
-                    full_response += markdown_buffer
-                    markdown_placeholder.markdown(full_response)
-
-                    if is_done:
-                        break
-        else:
-            full_response = f"API请求失败，状态码：{response.status_code}"
-            with st.chat_message("assistant"):
-                st.markdown(full_response)
+        with get_http_session().post(STREAM_API_URL, json={"query": query}, stream=True, timeout=30) as response:
+            if response.status_code == 200:
+                with st.chat_message("assistant"):
+                    markdown_placeholder = st.empty()
+                    last_flush = time.monotonic()
+                    # 新片段先收集到列表，渲染时才拼接，避免每个片段都复制整段已有文本
+                    pending = []
+                    pending_len = 0
+
+                    data_buffer = bytearray()
+                    for chunk in response.iter_content(chunk_size=None):
+                        if not chunk:
+                            continue
+
+                        results, is_done = process_sse_stream(chunk, data_buffer)
+                        pending.extend(results)
+                        pending_len += sum(map(len, results))
+
+                        now = time.monotonic()
+                        if pending and (now - last_flush > STREAM_RENDER_INTERVAL or pending_len > STREAM_RENDER_MIN_CHARS):
+                            full_response = "".join([full_response, *pending])
+                            pending.clear()
+                            pending_len = 0
+                            markdown_placeholder.markdown(full_response)
+                            last_flush = now
+
+                        if is_done:
+                            break
+
+                    if pending:
+                        full_response = "".join([full_response, *pending])
+                        markdown_placeholder.markdown(full_response)
+            else:
+                full_response = f"API请求失败，状态码：{response.status_code}"
+                with st.chat_message("assistant"):
+                    st.markdown(full_response)
 
     except Exception as exc:
         full_response = f"抱歉，发生错误：{exc}"